@@ -1,31 +1,59 @@
-from flask_sqlalchemy import SQLAlchemy
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_bcrypt import Bcrypt
 ##from flask_login import LoginManager
 from flask_mail import Mail
 from backend.config import Config
+from backend.migrations import upgrade_db_command
+from backend.routing import RoutingSQLAlchemy, ReplicaRouter
+from backend.sharding import ActivityShards
+from backend.archive import ActivityArchive
+from backend.limits import AdmissionControl
+from backend.stream import HabitEventStream
+from backend.responses import ResponseCompression
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 bcrypt = Bcrypt()
 ##login_manager = LoginManager()
 ##login_manager.login_view = 'login'
 ##login_manager.login_message_category = 'info'
 mail = Mail()
+replica_router = ReplicaRouter()
+activity_shards = ActivityShards()
+activity_archive = ActivityArchive()
+admission_control = AdmissionControl()
+habit_event_stream = HabitEventStream()
+response_compression = ResponseCompression()
 
-def create_app():
+def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
+    if app.config.get('TRUSTED_PROXY_HOPS'):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_HOPS'])
 
     db.init_app(app)
     bcrypt.init_app(app)
 ##    login_manager.init_app(app)
     mail.init_app(app)
+    replica_router.init_app(app)
+    activity_shards.init_app(app)
+    activity_archive.init_app(app)
+    admission_control.init_app(app)
+    habit_event_stream.init_app(app)
+    response_compression.init_app(app)
 
     from backend.events.routes import events
+    from backend.events.stats import reconcile_category_stats_command
     from backend.users.routes import users
     app.register_blueprint(events)
     app.register_blueprint(users)
+    app.cli.add_command(reconcile_category_stats_command)
+    app.cli.add_command(upgrade_db_command)
 
-    db.create_all(app=app)
+    # Only creates missing tables - columns and indexes added to deployed tables are left to the upgrade-db command,
+    # which builds them once per deployment rather than on the startup of every instance
+    db.create_all(bind=None, app=app)
+    with app.app_context():
+        activity_shards.create_tables()
 
     return app
@@ -0,0 +1,277 @@
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_sqlalchemy import get_state
+from pytz import timezone, utc
+from sqlalchemy import select
+
+# Layout of the header at the start of every archive file, followed by one little-endian uint32 count per day:
+# magic, version, habit ID, first day (days since 1970-01-01), number of days, total count, CRC32 of the counts and
+# the timezone the days are bucketed in
+HEADER = struct.Struct('<4sHxxQiIQI64s28x')
+MAGIC = b'HACT'
+VERSION = 1
+COUNT_DTYPE = np.dtype('<u4')
+
+EPOCH = date(1970, 1, 1)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class HabitArchive:
+    """Per-day activity counts of a single habit, read through a memory map - slicing counts copies nothing"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise ArchiveError("Truncated archive header in {}".format(path))
+
+        magic, version, self.habit_id, self.first_day, self.num_days, self.total_count, self.checksum, tz_name = \
+            HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ArchiveError("{} is not a version {} activity archive".format(path, VERSION))
+        self.tz_name = tz_name.rstrip(b'\0').decode('ascii')
+
+        if self.num_days:
+            self.counts = np.memmap(path, dtype=COUNT_DTYPE, mode='r', offset=HEADER.size, shape=(self.num_days,))
+        else:
+            self.counts = np.zeros(0, dtype=COUNT_DTYPE)
+
+    @property
+    def end_day(self):
+        """First day, as days since 1970-01-01, that is not archived"""
+        return self.first_day + self.num_days
+
+    @property
+    def archived_until(self):
+        """Naive UTC datetime from which activity is still held by the live table"""
+        from backend.events.utils import to_utc
+
+        return to_utc(timezone(self.tz_name), day_to_datetime(self.end_day))
+
+    def get_datewise_counts(self, start_day, end_day):
+        """Maps MM-DD-YY dates to counts for the archived days in [start_day, end_day)"""
+        offset = max(start_day, self.first_day) - self.first_day
+        window = self.counts[offset:max(min(end_day, self.end_day) - self.first_day, offset)]
+        return {day_to_datetime(self.first_day + offset + int(i)).strftime('%m-%d-%y'): int(window[i])
+                for i in np.flatnonzero(window)}
+
+    def verify(self):
+        """Checks the counts against the checksum and total stored in the header"""
+        data = np.ascontiguousarray(self.counts).tobytes()
+        if zlib.crc32(data) != self.checksum:
+            raise ArchiveError("Checksum mismatch in the archive of habit {}".format(self.habit_id))
+        if int(self.counts.sum(dtype=np.uint64)) != self.total_count:
+            raise ArchiveError("Count mismatch in the archive of habit {}".format(self.habit_id))
+
+
+class ActivityArchive:
+    """Compacts activity older than a cutoff into one file of per-day counts per habit, under ACTIVITY_ARCHIVE_DIR
+
+    get_habit_activity_data reads archived days from these files and only queries the live table from where the
+    archive of a habit ends. Without ACTIVITY_ARCHIVE_DIR nothing is archived or read.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.cache_size = 256
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache_size = app.config.get('ACTIVITY_ARCHIVE_CACHE_SIZE', 256)
+        app.extensions['activity_archive'] = self
+        app.cli.add_command(compact_activity_command)
+        app.cli.add_command(verify_activity_archive_command)
+
+    @staticmethod
+    def get_directory():
+        return current_app.config.get('ACTIVITY_ARCHIVE_DIR')
+
+    def get_path(self, habit_id):
+        return os.path.join(self.get_directory(), '{}.hact'.format(habit_id))
+
+    def get(self, habit_id):
+        """Returns the archive of a habit, or None if it has none"""
+        if not self.get_directory():
+            return None
+
+        path = self.get_path(habit_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        # Compaction replaces files instead of rewriting them, so the inode tells whether the cached map is stale
+        key = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached is None or cached[0] != key:
+                cached = (key, HabitArchive(path))
+                self._cache[path] = cached
+            self._cache.move_to_end(path)
+            # Every map holds a file descriptor until the last reference to it is dropped - evicted maps are not
+            # closed outright, as a request may still be slicing them, but are freed as soon as it is done
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return cached[1]
+
+    def write(self, habit_id, tz_name, first_day, counts):
+        """Atomically replaces the archive of a habit and returns it, read back and verified"""
+        counts = np.ascontiguousarray(counts, dtype=COUNT_DTYPE)
+        data = counts.tobytes()
+        header = HEADER.pack(MAGIC, VERSION, habit_id, first_day, len(counts), int(counts.sum(dtype=np.uint64)),
+                             zlib.crc32(data), tz_name.encode('ascii'))
+
+        path = self.get_path(habit_id)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        archive = self.get(habit_id)
+        archive.verify()
+        return archive
+
+    def compact(self, habit_id, tz_name, cutoff_day):
+        """Moves the activity of a habit from before the local day cutoff_day into its archive
+
+        Safe to run again after an interruption at any point. Live rows are only deleted once the archive holding
+        them has been written, read back and verified, and rows left over from an interrupted run are only deleted
+        if their per-day counts match the archive.
+
+        Returns
+        -------
+        int
+            Number of live rows deleted
+        """
+        from backend.events.utils import to_utc
+
+        # Days already archived stay bucketed in the timezone they were archived in
+        archive = self.get(habit_id)
+        if archive is not None:
+            tz_name = archive.tz_name
+        user_tz = timezone(tz_name)
+        cutoff = to_utc(user_tz, day_to_datetime(cutoff_day))
+        num_deleted = 0
+
+        if archive is not None:
+            leftover = self.get_day_counts(habit_id, user_tz, None, archive.archived_until)
+            if leftover:
+                for day, count in leftover.items():
+                    if not archive.first_day <= day < archive.end_day or archive.counts[day - archive.first_day] \
+                            != count:
+                        raise ArchiveError("Live activity of habit {} does not match its archive".format(habit_id))
+                num_deleted += self.delete_before(habit_id, archive.archived_until, sum(leftover.values()))
+            if archive.end_day >= cutoff_day:
+                return num_deleted
+            start = archive.archived_until
+        else:
+            start = None
+
+        day_counts = self.get_day_counts(habit_id, user_tz, start, cutoff)
+        if archive is None and not day_counts:
+            return num_deleted
+
+        first_day = archive.first_day if archive is not None else min(day_counts)
+        counts = np.zeros(cutoff_day - first_day, dtype=COUNT_DTYPE)
+        if archive is not None:
+            counts[:archive.num_days] = archive.counts
+        for day, count in day_counts.items():
+            counts[day - first_day] = count
+
+        new_archive = self.write(habit_id, tz_name, first_day, counts)
+        if new_archive.total_count != (archive.total_count if archive is not None else 0) + sum(day_counts.values()):
+            raise ArchiveError("Archive of habit {} does not reconcile with the live table".format(habit_id))
+
+        return num_deleted + self.delete_before(habit_id, cutoff, sum(day_counts.values()))
+
+    @staticmethod
+    def get_day_counts(habit_id, user_tz, start, end):
+        """Counts the live activity of a habit per local day, as days since 1970-01-01, between naive UTC datetimes
+        start (included, or from the beginning if None) and end (excluded)"""
+        shards = current_app.extensions['activity_shards']
+        table = shards.table
+
+        statement = select([table.c.timestamp]).where(table.c.habit_id == habit_id).where(table.c.timestamp < end)
+        if start is not None:
+            statement = statement.where(table.c.timestamp >= start)
+
+        day_counts = {}
+        for (timestamp,) in shards.execute(habit_id, statement):
+            day = (utc.localize(timestamp).astimezone(user_tz).date() - EPOCH).days
+            day_counts[day] = day_counts.get(day, 0) + 1
+        return day_counts
+
+    @staticmethod
+    def delete_before(habit_id, end, expected_count):
+        """Deletes the live activity of a habit before the naive UTC datetime end, unless it is not exactly the
+        expected_count rows that were archived"""
+        shards = current_app.extensions['activity_shards']
+        table = shards.table
+        session = get_state(current_app).db.session
+
+        result = shards.execute(habit_id, table.delete().where(table.c.habit_id == habit_id)
+                                .where(table.c.timestamp < end))
+        if result.rowcount != expected_count:
+            session.rollback()
+            raise ArchiveError("Expected to delete {} archived rows of habit {}, found {}".format(
+                expected_count, habit_id, result.rowcount))
+        session.commit()
+        return result.rowcount
+
+
+def day_to_datetime(day):
+    return datetime.combine(EPOCH + timedelta(days=day), datetime.min.time())
+
+
+@click.command('compact-activity')
+@click.option('--older-than', default=365, show_default=True, help="Age in days from which activity is archived")
+@with_appcontext
+def compact_activity_command(older_than):
+    """Move old activity of every habit into the activity archive."""
+    from backend.models import Habit, User
+
+    archive = current_app.extensions['activity_archive']
+    if not archive.get_directory():
+        raise click.UsageError("ACTIVITY_ARCHIVE_DIR is not configured")
+    os.makedirs(archive.get_directory(), exist_ok=True)
+
+    session = get_state(current_app).db.session
+    habits = session.query(Habit.id, User.timezone).join(User, Habit.user_id == User.id).all()
+
+    num_deleted = 0
+    for habit_id, tz_name in habits:
+        local_today = utc.localize(datetime.utcnow()).astimezone(timezone(tz_name)).date()
+        cutoff_day = (local_today - EPOCH).days - older_than
+        num_deleted += archive.compact(habit_id, tz_name, cutoff_day)
+
+    click.echo('Archived {} activity rows of {} habits'.format(num_deleted, len(habits)))
+
+
+@click.command('verify-activity-archive')
+@with_appcontext
+def verify_activity_archive_command():
+    """Check the checksum and total count of every activity archive."""
+    archive = current_app.extensions['activity_archive']
+    num_verified = 0
+    for file_name in sorted(os.listdir(archive.get_directory())):
+        if file_name.endswith('.hact'):
+            archive.get(int(file_name[:-len('.hact')])).verify()
+            num_verified += 1
+    click.echo('Verified {} activity archives'.format(num_verified))
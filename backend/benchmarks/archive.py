@@ -0,0 +1,81 @@
+"""Latency of reading a year of activity of a habit from the live table against reading it from the activity archive
+
+Seeds a SQLite file, times get_habit_activity_data year reads of a sample of habits, compacts the activity of those
+habits into the archive and times the same reads again - once cold, mapping every archive, and once warm::
+
+    python -m backend.benchmarks.archive --activities 10000000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from backend import create_app, db, activity_archive
+from backend.archive import EPOCH
+from backend.benchmarks.seed import create_database, seed, percentile, SEED_END
+from backend.config import TestConfig
+from backend.events.utils import get_habit_activity_data
+
+
+def time_reads(habit_ids):
+    """Returns the latency of a year read of every habit, and the number of activities they counted"""
+    latencies = []
+    num_activities = 0
+    for habit_id in habit_ids:
+        started = time.perf_counter()
+        datewise_activity_map = get_habit_activity_data(SEED_END, 365, habit_id)
+        latencies.append(time.perf_counter() - started)
+        num_activities += sum(datewise_activity_map.values())
+        db.session.remove()
+    return latencies, num_activities
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--habits', type=int, default=100000)
+    parser.add_argument('--activities', type=int, default=10000000)
+    parser.add_argument('--samples', type=int, default=1000, help='habits read, and compacted')
+    args = parser.parse_args()
+
+    engine, path = create_database()
+    archive_dir = tempfile.mkdtemp(prefix='habby-benchmark-archive-')
+    try:
+        print('Seeded {} habits and {} activities in {:.1f}s'.format(
+            args.habits, args.activities, seed(engine, args.habits, args.activities)))
+        engine.dispose()
+
+        class BenchmarkConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+            ACTIVITY_ARCHIVE_DIR = archive_dir
+            ACTIVITY_ARCHIVE_CACHE_SIZE = args.samples
+
+        app = create_app(BenchmarkConfig)
+        habit_ids = random.Random(0).sample(range(1, args.habits + 1), min(args.samples, args.habits))
+        with app.app_context():
+            results = [('live table',) + time_reads(habit_ids)]
+
+            started = time.perf_counter()
+            num_archived = sum(activity_archive.compact(habit_id, 'UTC', (SEED_END.date() - EPOCH).days)
+                               for habit_id in habit_ids)
+            print('Compacted {} activities of {} habits in {:.1f}s'.format(
+                num_archived, len(habit_ids), time.perf_counter() - started))
+
+            results.append(('archive, cold',) + time_reads(habit_ids))
+            results.append(('archive, warm',) + time_reads(habit_ids))
+
+            print('{:<20} {:>12} {:>10} {:>10} {:>10}'.format('read', 'activities', 'p50 ms', 'p95 ms', 'max ms'))
+            for name, latencies, num_activities in results:
+                print('{:<20} {:>12} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                    name, num_activities, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000,
+                    max(latencies) * 1000))
+            db.session.remove()
+            db.get_engine(app).dispose()
+    finally:
+        shutil.rmtree(archive_dir)
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
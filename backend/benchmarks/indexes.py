@@ -0,0 +1,91 @@
+"""Latency of the hot lookups before and after the indexes declared on the models are created
+
+Seeds a SQLite file, times every lookup without the secondary indexes, creates them the way the upgrade-db command does
+and
+times the lookups again::
+
+    python -m backend.benchmarks.indexes --activities 10000000
+"""
+import argparse
+import os
+import random
+import time
+from datetime import timedelta
+
+from sqlalchemy import select
+
+from backend.benchmarks.seed import create_database, drop_secondary_indexes, seed, percentile, SEED_END, \
+    HABITS_PER_USER
+from backend.migrations import create_missing_indexes
+from backend.models import User, Habit, Activity
+
+
+def get_lookups(num_habits):
+    """Returns the lookups of the request paths the indexes are for, each as (name, function making a statement)"""
+    num_users = max(num_habits // HABITS_PER_USER, 1)
+    return [
+        ('activity range (get_habit_activity_data)',
+         lambda rng: select([Activity.timestamp]).where(Activity.habit_id == rng.randint(1, num_habits)).where(
+             Activity.timestamp <= SEED_END).where(Activity.timestamp >= SEED_END - timedelta(days=7))),
+        ('habits of user (get_all_user_habits)',
+         lambda rng: select([Habit.id]).where(Habit.user_id == rng.randint(1, num_users))),
+        ('user by email (login, register)',
+         lambda rng: select([User.id]).where(User.email == 'user{}@check.com'.format(rng.randint(1, num_users)))),
+        ('user by name and snapPic (Snapchat login)', lambda rng: get_snap_lookup(rng.randint(1, num_users))),
+    ]
+
+
+def get_snap_lookup(user_id):
+    return select([User.id]).where(User.name == 'User{}'.format(user_id)).where(
+        User.snapPic == 'https://check.com/{}.png'.format(user_id))
+
+
+def time_lookups(engine, lookups, samples):
+    results = {}
+    with engine.connect() as connection:
+        for name, make_statement in lookups:
+            rng = random.Random(name)
+            latencies = []
+            for _ in range(samples):
+                statement = make_statement(rng)
+                started = time.perf_counter()
+                connection.execute(statement).fetchall()
+                latencies.append(time.perf_counter() - started)
+            results[name] = latencies
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--habits', type=int, default=100000)
+    parser.add_argument('--activities', type=int, default=10000000)
+    parser.add_argument('--samples', type=int, default=20,
+                        help='lookups timed per query - unindexed ones scan the whole table every time')
+    args = parser.parse_args()
+
+    engine, path = create_database()
+    try:
+        drop_secondary_indexes(engine)
+        print('Seeded {} habits and {} activities in {:.1f}s'.format(
+            args.habits, args.activities, seed(engine, args.habits, args.activities)))
+
+        lookups = get_lookups(args.habits)
+        before = time_lookups(engine, lookups, args.samples)
+        started = time.perf_counter()
+        create_missing_indexes(engine, Activity.metadata)
+        print('Created indexes in {:.1f}s'.format(time.perf_counter() - started))
+        after = time_lookups(engine, lookups, args.samples)
+
+        print('{:<45} {:>14} {:>14} {:>14} {:>14}'.format('lookup', 'p50 before ms', 'p95 before ms',
+                                                          'p50 after ms', 'p95 after ms'))
+        for name, _ in lookups:
+            print('{:<45} {:>14.3f} {:>14.3f} {:>14.3f} {:>14.3f}'.format(
+                name, percentile(before[name], 0.5) * 1000, percentile(before[name], 0.95) * 1000,
+                percentile(after[name], 0.5) * 1000, percentile(after[name], 0.95) * 1000))
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Memory and throughput of ORM instances against column-only projections on the read paths using them
+
+Seeds a SQLite file and runs every read path both ways, reporting rows per second and the tracemalloc peak. The
+settlement is measured as it ships - a whole update_habit_data run, whose drained reads only make progress as its
+writes settle users - against loading the cohort into ORM instances the way it did before projections::
+
+    python -m backend.benchmarks.projections --habits 100000 --activities 10000000
+"""
+import argparse
+import gc
+import os
+import time
+import tracemalloc
+import json
+from datetime import timedelta
+from unittest import mock
+
+from sqlalchemy import select
+
+from backend import create_app, db
+from backend.benchmarks.seed import create_database, seed, SEED_END
+from backend.config import TestConfig
+from backend.events.routes import update_habit_data
+from backend.models import User, Habit, Activity
+from backend.projections import HabitRow, project, iter_chunks
+
+# Habits whose year of activity is read by the activity paths
+NUM_ACTIVITY_HABITS = 1000
+
+
+def read_habits_orm():
+    return len(Habit.query.all())
+
+
+def read_habits_projected():
+    return sum(len(chunk) for chunk in iter_chunks(HabitRow, project(HabitRow), Habit.id))
+
+
+def read_activity_orm():
+    num_rows = 0
+    for habit_id in range(1, NUM_ACTIVITY_HABITS + 1):
+        num_rows += len(Activity.query.filter(Activity.habit_id == habit_id,
+                                              Activity.timestamp >= SEED_END - timedelta(days=365)).all())
+    return num_rows
+
+
+def read_activity_projected():
+    num_rows = 0
+    for habit_id in range(1, NUM_ACTIVITY_HABITS + 1):
+        num_rows += len(db.session.execute(select([Activity.timestamp]).where(Activity.habit_id == habit_id).where(
+            Activity.timestamp >= SEED_END - timedelta(days=365))).fetchall())
+    return num_rows
+
+
+def read_cohort_orm():
+    # What the settlement loaded before projections - every habit of the cohort with its user's timezone
+    return len(db.session.query(Habit, User.timezone).join(User, Habit.user_id == User.id)
+               .filter(User.timezone == 'UTC').all())
+
+
+def settle_cohort():
+    # Seeded users are all in UTC and were never settled, so the run at its midnight settles every habit
+    with db.get_app().test_request_context('/event/activity/get_data'), \
+            mock.patch('backend.events.routes.datetime') as mock_datetime:
+        mock_datetime.utcnow.return_value = SEED_END
+        return json.loads(update_habit_data().get_data())['num_settled']
+
+
+def unsettle_cohort():
+    db.session.execute(User.__table__.update().values(last_settled_day=None))
+    db.session.commit()
+
+
+PATHS = [
+    ('all habits', read_habits_orm, read_habits_projected, None),
+    ('year of activity, {} habits'.format(NUM_ACTIVITY_HABITS), read_activity_orm, read_activity_projected, None),
+    ('settlement cohort (whole run)', read_cohort_orm, settle_cohort, unsettle_cohort),
+]
+
+
+def measure(function, reset=None):
+    """Runs function twice in a fresh session - once timed, once under tracemalloc - and returns the number of rows
+    it read, rows per second and the peak of allocated bytes
+
+    reset, if given, undoes the writes of function before each run.
+    """
+    def prepare():
+        db.session.remove()
+        if reset is not None:
+            reset()
+            db.session.remove()
+        gc.collect()
+
+    prepare()
+    started = time.perf_counter()
+    num_rows = function()
+    elapsed = time.perf_counter() - started
+
+    prepare()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    db.session.remove()
+
+    return num_rows, num_rows / elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--habits', type=int, default=100000)
+    parser.add_argument('--activities', type=int, default=10000000)
+    args = parser.parse_args()
+
+    engine, path = create_database()
+    try:
+        print('Seeded {} habits and {} activities in {:.1f}s'.format(
+            args.habits, args.activities, seed(engine, args.habits, args.activities)))
+        engine.dispose()
+
+        class BenchmarkConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+            # Recorded queries keep their parameters for as long as the app context - all of the benchmark
+            SQLALCHEMY_RECORD_QUERIES = False
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            print('{:<35} {:>10} {:>14} {:>14} {:>14} {:>14}'.format('path', 'rows', 'ORM rows/s', 'rows/s',
+                                                                     'ORM peak MB', 'peak MB'))
+            for name, orm_function, projected_function, reset in PATHS:
+                num_rows, orm_rate, orm_peak = measure(orm_function)
+                _, rate, peak = measure(projected_function, reset)
+                print('{:<35} {:>10} {:>14.0f} {:>14.0f} {:>14.1f} {:>14.1f}'.format(
+                    name, num_rows, orm_rate, rate, orm_peak / 2 ** 20, peak / 2 ** 20))
+            db.session.remove()
+            db.get_engine(app).dispose()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
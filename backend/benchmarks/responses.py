@@ -0,0 +1,112 @@
+"""CPU and size of the JSON responses of the largest endpoints, as sent before and after the response layer
+
+For every endpoint the body is serialized the way handlers used to (json.dumps) and through backend.responses, and
+compressed with every encoding available::
+
+    python -m backend.benchmarks.responses --habits 50
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+from backend import create_app, db
+from backend.config import TestConfig
+from backend.models import User, Habit, Category, Activity
+from backend.responses import dumps, gzip_compress, brotli
+
+# Number of categories get_sorted_cat scores
+NUM_CATEGORIES = 40
+
+
+def seed_app(num_habits):
+    """Fills the database with a user whose habits have a week of activity, the first one a year, and returns the
+    auth token of the user"""
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    for cat_id in range(1, NUM_CATEGORIES + 1):
+        db.session.add(Category(id=cat_id, name='Category {}'.format(cat_id), level=3, ideal_num=0))
+    db.session.add(User(id=1, name='Benchmark', email='benchmark@check.com', password='check'))
+    for habit_id in range(1, num_habits + 1):
+        db.session.add(Habit(id=habit_id, name='Habit {}'.format(habit_id), curr_num=rng.uniform(1, 20),
+                             init_num=20, pref_level=2, change_index=0.95, curr_target=5, user_id=1,
+                             cat_id=rng.randint(1, NUM_CATEGORIES)))
+        num_days = 365 if habit_id == 1 else 7
+        for day in range(num_days):
+            for _ in range(rng.randint(0, 3)):
+                db.session.add(Activity(habit_id=habit_id, timestamp=now - timedelta(days=day, minutes=rng.randint(
+                    0, 600))))
+    db.session.commit()
+    return User.query.get(1).get_auth_token()
+
+
+def get_requests(auth_token):
+    """Returns the endpoints measured, as (name, path, JSON body)"""
+    test_date = (datetime.utcnow() + timedelta(days=1)).strftime('%m-%d-%y')
+    return [
+        ('get_all_user_habits', '/event/habit/get_all', {'auth_token': auth_token}),
+        ('get_activity_data (Y)', '/event/activity/get_data', {'auth_token': auth_token, 'habit_id': 1,
+                                                               'mode': 'Y', 'test_date': test_date}),
+        ('get_sorted_cat', '/event/cat/get_sorted', {'auth_token': auth_token, 'text': 'benchmark'}),
+        ('get_cat_stats', '/event/cat/get_stats', {'auth_token': auth_token, 'cat_id': 1}),
+        ('forecast_user_habits', '/event/habit/forecast', {'auth_token': auth_token, 'num_samples': 20}),
+    ]
+
+
+def time_call(function, repeat):
+    """Returns the CPU seconds of one call of function, averaged over repeat calls"""
+    started = time.process_time()
+    for _ in range(repeat):
+        function()
+    return (time.process_time() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--habits', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    class BenchmarkConfig(TestConfig):
+        RATE_LIMITS = {}
+        ENDPOINT_CONCURRENCY_CLASSES = {}
+
+    app = create_app(BenchmarkConfig)
+    client = app.test_client()
+    scoring = mock.Mock(json=lambda: {'weightedScoring': random.random()})
+
+    encodings = [('gzip', lambda body: gzip_compress(body, app.config['COMPRESS_GZIP_LEVEL']))]
+    if brotli is not None:
+        encodings.append(('br', lambda body: brotli.compress(body, quality=app.config['COMPRESS_BROTLI_QUALITY'])))
+
+    print('Sizes in bytes, CPU in microseconds per response - req plain and req gzip are whole requests without and '
+          'with Accept-Encoding')
+    print('{:<24} {:>10} {:>10}'.format('endpoint', 'old bytes', 'new bytes') +
+          ''.join(' {:>10}'.format(name + ' bytes') for name, _ in encodings) +
+          ' {:>10} {:>10}'.format('old ser', 'new ser') +
+          ''.join(' {:>10}'.format(name + ' cpu') for name, _ in encodings) +
+          ' {:>10} {:>10}'.format('req plain', 'req gzip'))
+
+    with app.app_context(), mock.patch('backend.events.routes.requests.post', return_value=scoring):
+        auth_token = seed_app(args.habits)
+        for name, path, body in get_requests(auth_token):
+            data = json.loads(client.post(path, json=body).data.decode('utf-8'))
+            new_body = dumps(data)
+            line = '{:<24} {:>10} {:>10}'.format(name, len(json.dumps(data)), len(new_body))
+            line += ''.join(' {:>10}'.format(len(compress(new_body))) for _, compress in encodings)
+            line += ' {:>10.1f} {:>10.1f}'.format(time_call(lambda: json.dumps(data), args.repeat) * 1e6,
+                                                  time_call(lambda: dumps(data), args.repeat) * 1e6)
+            line += ''.join(' {:>10.1f}'.format(time_call(lambda: compress(new_body), args.repeat) * 1e6)
+                            for _, compress in encodings)
+            num_requests = max(args.repeat // 10, 1)
+            line += ' {:>10.0f} {:>10.0f}'.format(
+                time_call(lambda: client.post(path, json=body), num_requests) * 1e6,
+                time_call(lambda: client.post(path, json=body, headers={'Accept-Encoding': 'gzip, br'}),
+                          num_requests) * 1e6)
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from backend import db
+from backend import models  # noqa: F401 - registers the tables on db.metadata
+
+# Format SQLAlchemy stores DateTime columns in on SQLite - raw inserts have to match it for range filters to work
+SQLITE_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Activity is spread over the year before this day
+SEED_END = datetime(2019, 1, 1)
+
+# Rows per executemany while seeding
+BATCH_SIZE = 50000
+
+# Seeded users have this many habits each, and are named User<id> with the email user<id>@check.com
+HABITS_PER_USER = 5
+
+
+def create_database(path=None):
+    """Returns an engine for an empty SQLite file holding every table of the models, and the path of the file"""
+    if path is None:
+        handle, path = tempfile.mkstemp(suffix='.db', prefix='habby-benchmark-')
+        os.close(handle)
+        os.remove(path)
+    engine = create_engine('sqlite:///' + path)
+    db.metadata.create_all(engine)
+    return engine, path
+
+
+def drop_secondary_indexes(engine):
+    """Drops every index declared on the models, leaving the tables as they were before indexing"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(bind=engine)
+
+
+def insert_batches(engine, statement, rows):
+    connection = engine.raw_connection()
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                connection.executemany(statement, batch)
+                batch = []
+        if batch:
+            connection.executemany(statement, batch)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def seed(engine, num_habits, num_activities, seed_value=0):
+    """Fills the database with a category, num_habits habits and num_activities activities spread over a year
+
+    Returns the number of seconds it took.
+    """
+    started = time.perf_counter()
+    rng = random.Random(seed_value)
+    num_users = max(num_habits // HABITS_PER_USER, 1)
+
+    insert_batches(engine, 'INSERT INTO category (id, name, level, ideal_num) VALUES (?, ?, ?, ?)',
+                   [(1, 'Benchmark', 3, 0)])
+    insert_batches(engine, 'INSERT INTO user (id, name, email, password, "isAdmin", "isSnap", "snapPic", timezone) '
+                           'VALUES (?, ?, ?, ?, 0, 0, ?, ?)',
+                   ((i, 'User{}'.format(i), 'user{}@check.com'.format(i), 'check',
+                     'https://check.com/{}.png'.format(i), 'UTC') for i in range(1, num_users + 1)))
+    insert_batches(engine, 'INSERT INTO habit (id, name, curr_num, init_num, pref_level, change_index, curr_target, '
+                           'user_id, cat_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)',
+                   ((i, 'Habit{}'.format(i), 10.0, 10.0, 2, 0.95, 10, (i - 1) // HABITS_PER_USER + 1)
+                    for i in range(1, num_habits + 1)))
+
+    start = SEED_END - timedelta(days=365)
+    insert_batches(engine, 'INSERT INTO activity (habit_id, timestamp) VALUES (?, ?)',
+                   ((rng.randint(1, num_habits),
+                     (start + timedelta(seconds=rng.randrange(365 * 86400))).strftime(SQLITE_DATETIME_FORMAT))
+                    for _ in range(num_activities)))
+
+    with engine.connect() as connection:
+        connection.execute('ANALYZE')
+    return time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
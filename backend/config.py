@@ -20,3 +20,74 @@ class Config:
         connection_name=CLOUDSQL_CONNECTION_NAME)
 #    SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Comma separated URIs of the read replicas - read-only endpoints are spread over them
+    REPLICA_DATABASE_URIS = [x for x in os.environ.get('REPLICA_DATABASE_URIS', '').split(',') if x]
+    SQLALCHEMY_REPLICA_BINDS = ['replica_{}'.format(i) for i in range(len(REPLICA_DATABASE_URIS))]
+    # Comma separated URIs of the databases the activity table is partitioned over - kept on the primary if empty
+    ACTIVITY_SHARD_URIS = [x for x in os.environ.get('ACTIVITY_SHARD_URIS', '').split(',') if x]
+    ACTIVITY_SHARD_BINDS = ['activity_{}'.format(i) for i in range(len(ACTIVITY_SHARD_URIS))]
+    SQLALCHEMY_BINDS = dict(zip(SQLALCHEMY_REPLICA_BINDS + ACTIVITY_SHARD_BINDS,
+                                REPLICA_DATABASE_URIS + ACTIVITY_SHARD_URIS))
+    # Directory holding the per-day counts of archived activity - activity is never archived if not set
+    ACTIVITY_ARCHIVE_DIR = os.environ.get('ACTIVITY_ARCHIVE_DIR')
+    # Archives kept memory mapped per worker, each holding an open file
+    ACTIVITY_ARCHIVE_CACHE_SIZE = 256
+    # Endpoints sharing a concurrency limit - requests over the limit of their class are shed with a 503
+    ENDPOINT_CONCURRENCY_CLASSES = {
+        'queues.get_sorted_cat': 'outbound',
+        'users.login': 'password',
+        'users.normal_register': 'password',
+        'users.reset_password': 'password',
+        'queues.stream_habit_events': 'stream',
+        'queues.forecast_user_habits': 'simulation'
+    }
+    # Together kept well below the threads of a worker in gunicorn.conf.py, which refuses to start otherwise, so the
+    # cheap endpoints always have threads left - open event streams only become cheap with
+    # GUNICORN_WORKER_CLASS=gevent, where STREAM_CONNECTION_LIMIT can go to thousands
+    CONCURRENCY_LIMITS = {'outbound': 2, 'password': 2, 'simulation': 2,
+                          'stream': int(os.environ.get('STREAM_CONNECTION_LIMIT', 2))}
+    CONCURRENCY_SLOT_TTL = 120
+    CONCURRENCY_RETRY_AFTER = 1
+    # Token buckets per user, as (tokens per second, burst) - requests finding the bucket empty get a 429
+    RATE_LIMITS = {
+        'queues.get_sorted_cat': (0.5, 5),
+        'users.login': (0.2, 5),
+        'users.normal_register': (0.05, 3),
+        'users.reset_password': (0.05, 3),
+        'queues.forecast_user_habits': (0.1, 5)
+    }
+    # Number of proxies in front of the app that append the address they received a request from to X-Forwarded-For
+    # - the client address is the one the outermost of them added, as anything further left is up to the client
+    TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))
+    # SQLite file shared by the workers of a host for the limiter state - kept per worker if not set
+    LIMITER_STORAGE_PATH = os.environ.get('LIMITER_STORAGE_PATH')
+    # Forecasts simulate scenarios x samples x habits x days steps - samples are reduced to stay within the budget,
+    # which takes around 70ms
+    FORECAST_MAX_SCENARIOS = 5
+    FORECAST_MAX_STEPS = 10000000
+    # Seconds to wait for the category comparison service before scoring a category 0
+    CORTICAL_TIMEOUT_SECONDS = 5
+    # Event streams send a heartbeat when idle, drop the queue of clients lagging behind and close after a while
+    STREAM_HEARTBEAT_SECONDS = 15
+    STREAM_MAX_QUEUED = 100
+    STREAM_MAX_SECONDS = 100
+    # Responses of these types are compressed for clients accepting gzip or brotli once they reach COMPRESS_MIN_SIZE
+    # bytes - below that the saved bytes are not worth the CPU
+    COMPRESS_MIMETYPES = ['application/json']
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 5
+    # Seconds after a write during which the reads of the same user still go to the primary
+    REPLICA_STALENESS_SECONDS = 5
+    # Seconds a failed replica is left out before it is tried again
+    REPLICA_RETRY_SECONDS = 30
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_BINDS = {}
+    SQLALCHEMY_REPLICA_BINDS = []
+    ACTIVITY_SHARD_BINDS = []
+    ACTIVITY_ARCHIVE_DIR = None
+    LIMITER_STORAGE_PATH = None
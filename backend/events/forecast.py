@@ -0,0 +1,93 @@
+import numpy as np
+
+# Smallest change index used when projecting - habits with a change index of 0 would otherwise divide by zero on a
+# missed day
+MIN_CHANGE_INDEX = 1e-3
+
+# Percentiles reported as the confidence band around every projection
+BAND_PERCENTILES = (10, 50, 90)
+
+
+def forecast_habits(curr_nums, change_indexes, ideal_nums, num_days, adherence_levels, num_samples, seed=None):
+    """Projects a set of habits num_days ahead under a set of adherence scenarios
+
+    Follows the daily rule of update_habit_data. On a day the user sticks to curr_target, curr_num is multiplied by
+    the change index; on a day they exceed it by one, curr_num is divided by it. Every day is independently kept
+    with probability equal to the adherence of the scenario, and the random rounding of set_target is sampled for the
+    projected targets. All habits, scenarios and samples are simulated at once.
+
+    A habit counts as having reached its ideal once curr_num drops to ideal_num + 0.5, from where set_target rounds
+    to the ideal number at least half of the time.
+
+    Parameters
+    ----------
+    curr_nums : sequence of float
+        Current number of every habit
+    change_indexes : sequence of float
+        Change index of every habit
+    ideal_nums : sequence of int
+        Ideal number of the category of every habit
+    num_days : int
+        Number of days to project ahead
+    adherence_levels : sequence of float
+        Probability, for every scenario, that the user sticks to the target on any given day
+    num_samples : int
+        Number of Monte Carlo samples drawn per habit and scenario
+    seed : int, optional
+        Seed of the random generator, for reproducible forecasts
+
+    Returns
+    -------
+    dict(str -> numpy.ndarray)
+        reach_probability : (scenarios, habits) - share of samples reaching the ideal within num_days
+        expected_day : (scenarios, habits) - mean day the ideal is reached among those samples, NaN if none does
+        day_bands : (scenarios, habits, bands) - percentiles of the day the ideal is reached, inf if not reached
+        num_bands : (scenarios, habits, bands) - percentiles of curr_num after num_days
+        target_bands : (scenarios, habits, bands) - percentiles of curr_target after num_days
+    """
+    rng = np.random.default_rng(seed)
+
+    curr_nums = np.asarray(curr_nums, dtype=np.float64)
+    change_indexes = np.clip(np.asarray(change_indexes, dtype=np.float64), MIN_CHANGE_INDEX, 1)
+    ideal_nums = np.asarray(ideal_nums, dtype=np.float64)
+    adherence = np.asarray(adherence_levels, dtype=np.float32)[:, None, None]
+    shape = (len(adherence_levels), num_samples, len(curr_nums))
+
+    # curr_num after any number of days only depends on the difference between kept and missed days (the walk), so
+    # reaching the ideal is the first day the walk climbs to the threshold below
+    with np.errstate(divide='ignore', invalid='ignore'):
+        threshold = np.log((ideal_nums + 0.5) / curr_nums) / np.log(change_indexes)
+    threshold = np.where(curr_nums <= ideal_nums + 0.5, 0, np.nan_to_num(np.ceil(threshold), nan=np.inf))
+    threshold = np.minimum(threshold, num_days + 1)
+
+    walk = np.zeros(shape, dtype=np.int16)
+    reached_day = np.broadcast_to(np.where(threshold <= 0, 0, num_days + 1).astype(np.int16), shape).copy()
+    hit = np.empty(shape, dtype=bool)
+
+    for day in range(1, num_days + 1):
+        kept = rng.random(shape, dtype=np.float32) < adherence
+        walk += kept
+        walk += kept
+        walk -= 1
+        np.greater_equal(walk, threshold, out=hit)
+        hit &= reached_day > day
+        reached_day[hit] = day
+
+    projected_num = curr_nums * change_indexes ** walk
+    projected_target = np.floor(projected_num + rng.random(shape))
+
+    reached = reached_day <= num_days
+    reach_count = reached.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected_day = np.where(reached, reached_day, 0).sum(axis=1) / reach_count
+    # Samples that never reach the ideal sit at num_days + 1, so any band past num_days is not reached
+    day_bands = np.percentile(reached_day, BAND_PERCENTILES, axis=1)
+    day_bands[day_bands > num_days] = np.inf
+
+    return {
+        'reach_probability': reach_count / num_samples,
+        'expected_day': expected_day,
+        'day_bands': np.moveaxis(day_bands, 0, -1),
+        'num_bands': np.moveaxis(np.percentile(projected_num, BAND_PERCENTILES, axis=1), 0, -1),
+        'target_bands': np.moveaxis(np.percentile(projected_target, BAND_PERCENTILES, axis=1), 0, -1),
+    }
@@ -1,11 +1,14 @@
-from flask import Blueprint, request, current_app
+from flask import Blueprint, request, current_app, Response, stream_with_context
 from backend.models import User, Category, Habit, Activity
-from backend import db, mail
-import json
+from backend.responses import json_response
+from backend import db, mail, replica_router, activity_shards, habit_event_stream
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask_mail import Message
-from backend.events.utils import get_habit_activity_data, get_change_index, set_target
+from backend.events.stats import get_habit_metrics, update_category_stats, get_category_stats
+from backend.projections import HabitRow, SettlementUserRow, project, rows, iter_drained
+from backend.events.utils import get_habit_activity_data, get_change_index, set_target, get_settlement_timezones, \
+    get_local_today, settle_users, get_forecast_data, get_local_date_string
 
 events = Blueprint('queues', __name__)
 
@@ -50,10 +53,10 @@ def add_new_category():
     user = User.verify_auth_token(auth_token)
 
     if user is None:
-        return json.dumps({'status': 0, 'error': "User Not Authenticated"})
+        return json_response({'status': 0, 'error': "User Not Authenticated"})
 
     if not user.isAdmin:
-        return json.dumps({'status': 0, 'error': "Access Denied"})
+        return json_response({'status': 0, 'error': "Access Denied"})
 
     cat_name = request_json['cat_name']
     cat_level = request_json['cat_level']
@@ -62,7 +65,7 @@ def add_new_category():
     db.session.add(new_cat)
     db.session.commit()
 
-    return json.dumps({'status': 1})
+    return json_response({'status': 1})
 
 
 @events.route('/event/habit/attach', methods=['POST'])
@@ -102,7 +105,7 @@ def attach_habit_to_user():
     user = User.verify_auth_token(auth_token)
 
     if user is None:
-        return json.dumps({'status': 0, 'error': "User Not Authenticated"})
+        return json_response({'status': 0, 'error': "User Not Authenticated"})
 
     habit_name = request_json['habit_name']
     pref_level = request_json['pref_level']
@@ -112,18 +115,29 @@ def attach_habit_to_user():
     cat = Category.query.filter_by(id=cat_id).first()
 
     if not cat:
-        return json.dumps({'status': 0, 'error': "Category Not Found"})
+        return json_response({'status': 0, 'error': "Category Not Found"})
 
     change_index = get_change_index(cat.level, pref_level)
 
     new_habit = Habit(name=habit_name, pref_level=pref_level, change_index=change_index, user_id=user.id, cat_id=cat_id,
                       curr_num=curr_num, init_num=curr_num)
     db.session.add(new_habit)
+    update_category_stats(cat_id, None, get_habit_metrics(curr_num, curr_num))
     db.session.commit()
 
     set_target(new_habit.id)
 
-    return json.dumps({'status': 1})
+    habit_event_stream.publish(user.id, 'habit_added', {
+        'id': new_habit.id,
+        'name': new_habit.name,
+        'curr_num': new_habit.curr_num,
+        'init_num': new_habit.init_num,
+        'pref_level': new_habit.pref_level,
+        'curr_target': new_habit.curr_target,
+        'cat_id': new_habit.cat_id
+    })
+
+    return json_response({'status': 1})
 
 
 @events.route('/event/activity/report', methods=['POST'])
@@ -157,25 +171,29 @@ def report_activity():
     user = User.verify_auth_token(auth_token)
 
     if user is None:
-        return json.dumps({'status': 0, 'error': "User Not Authenticated"})
+        return json_response({'status': 0, 'error': "User Not Authenticated"})
 
     habit_id = request_json['habit_id']
     habit = Habit.query.filter_by(id=habit_id).first()
 
     if not habit:
-        return json.dumps({'status': 0, 'error': "Habit Not Found"})
+        return json_response({'status': 0, 'error': "Habit Not Found"})
 
     if user.id != habit.user_id:
-        return json.dumps({'status': 0, 'error': "The selected habit does not belong to the logged in user."})
+        return json_response({'status': 0, 'error': "The selected habit does not belong to the logged in user."})
 
-    new_activity = Activity(habit_id=habit_id)
-    db.session.add(new_activity)
+    timestamp = datetime.utcnow()
+    activity_shards.execute(habit_id, Activity.__table__.insert().values(habit_id=habit_id, timestamp=timestamp))
     db.session.commit()
 
-    return json.dumps({'status': 1})
+    habit_event_stream.publish(user.id, 'activity', {'habit_id': habit.id,
+                                                     'date': get_local_date_string(user.timezone, timestamp)})
+
+    return json_response({'status': 1})
 
 
 @events.route('/event/activity/get_data', methods=['POST'])
+@replica_router.read_only
 def get_activity_data():
     """Get all logged activity data of a habit
 
@@ -216,37 +234,40 @@ def get_activity_data():
     user = User.verify_auth_token(auth_token)
 
     if user is None:
-        return json.dumps({'status': 0, 'error': "User Not Authenticated"})
+        return json_response({'status': 0, 'error': "User Not Authenticated"})
 
     habit_id = request_json['habit_id']
     habit = Habit.query.filter_by(id=habit_id).first()
 
     if not habit:
-        return json.dumps({'status': 0, 'error': "Habit Not Found"})
+        return json_response({'status': 0, 'error': "Habit Not Found"})
 
     if user.id != habit.user_id:
-        return json.dumps({'status': 0, 'error': "The selected habit does not belong to the logged in user."})
+        return json_response({'status': 0, 'error': "The selected habit does not belong to the logged in user."})
 
     mode = request_json['mode']
 
     test_date = datetime.strptime(request_json['test_date'], '%m-%d-%y')
 
     if mode == 'W':
-        datewise_activity_map = get_habit_activity_data(test_date, 7, habit_id)
+        datewise_activity_map = get_habit_activity_data(test_date, 7, habit_id, user.timezone)
     elif mode == 'M':
-        datewise_activity_map = get_habit_activity_data(test_date, 30, habit_id)
+        datewise_activity_map = get_habit_activity_data(test_date, 30, habit_id, user.timezone)
     elif mode == 'Y':
-        datewise_activity_map = get_habit_activity_data(test_date, 365, habit_id)
+        datewise_activity_map = get_habit_activity_data(test_date, 365, habit_id, user.timezone)
     else:
-        return json.dumps({'status': 0, 'error': "Invalid Mode Provided"})
+        return json_response({'status': 0, 'error': "Invalid Mode Provided"})
 
-    return json.dumps({'status': 1, 'datewise_activity_map': datewise_activity_map})
+    return json_response({'status': 1, 'datewise_activity_map': datewise_activity_map})
 
 
 @events.route('/event/activity/get_data', methods=['GET'])
 def update_habit_data():
     """Update habit data based on the activities logged in on the previous day
 
+    Meant to be triggered every hour - each run settles the habits of users for every local day that has ended since
+    they were last settled, and running it again settles nothing more
+
     Method Type: GET
 
     Special Restrictions
@@ -258,28 +279,37 @@ def update_habit_data():
     JSON
         status : int
             Tells whether or not did the function work - 1 for success, 0 for failure
+        num_settled : int
+            Number of habits settled by this run
     """
-    curr_time = datetime.now()
-    date_string = curr_time.strftime("%m-%d-%y")
-    curr_date = datetime.strptime(date_string, "%m-%d-%y")
+    curr_time = datetime.utcnow()
+    first_hour_timezones = set(get_settlement_timezones(curr_time))
 
-    all_habits = Habit.query.all()
+    num_settled = 0
 
-    for each_habit in all_habits:
-        single_activity_map = get_habit_activity_data(curr_date, 1, each_habit.id)
-        num_times = single_activity_map.get(date_string, default=0)
-        diff = each_habit.curr_target - num_times
-        if diff >= 0:
-            each_habit.curr_num *= each_habit.change_index ** (diff + 1)
-        else:
-            each_habit.curr_num /= each_habit.change_index ** (diff * (-1))
-        db.session.commit()
-        set_target(each_habit.id)
+    # Users are read a chunk at a time straight from the (timezone, last_settled_day) index and leave the query as
+    # they are settled, so the memory used does not grow with the size of the cohort and a repeated run finds nothing
+    for (tz_name,) in db.session.query(User.timezone).distinct().all():
+        ended_day = (get_local_today(tz_name, curr_time) - timedelta(days=1)).date()
 
-    return json.dumps({'status': 1})
+        # Every ended day after the last settled one is settled in turn - a missed run, or a midnight skipped by a
+        # DST change, only delays a day instead of losing it
+        settled_query = project(SettlementUserRow, User.timezone == tz_name,
+                                User.last_settled_day < ended_day).with_for_update()
+        for cohort_users in iter_drained(SettlementUserRow, settled_query):
+            num_settled += settle_users(tz_name, {x.id: x.last_settled_day + timedelta(days=1) for x in cohort_users})
+
+        if tz_name in first_hour_timezones:
+            new_query = project(SettlementUserRow, User.timezone == tz_name,
+                                User.last_settled_day.is_(None)).with_for_update()
+            for cohort_users in iter_drained(SettlementUserRow, new_query):
+                num_settled += settle_users(tz_name, {x.id: ended_day for x in cohort_users})
+
+    return json_response({'status': 1, 'num_settled': num_settled})
 
 
 @events.route('/event/habit/get_data', methods=['POST'])
+@replica_router.read_only
 def get_habit_data():
     """Get basic data of a habit
 
@@ -312,18 +342,18 @@ def get_habit_data():
     user = User.verify_auth_token(auth_token)
 
     if user is None:
-        return json.dumps({'status': 0, 'error': "User Not Authenticated"})
+        return json_response({'status': 0, 'error': "User Not Authenticated"})
 
     habit_id = request_json['habit_id']
     habit = Habit.query.filter_by(id=habit_id).first()
 
     if not habit:
-        return json.dumps({'status': 0, 'error': "Habit Not Found"})
+        return json_response({'status': 0, 'error': "Habit Not Found"})
 
     if user.id != habit.user_id:
-        return json.dumps({'status': 0, 'error': "The selected habit does not belong to the logged in user."})
+        return json_response({'status': 0, 'error': "The selected habit does not belong to the logged in user."})
 
-    return json.dumps({
+    return json_response({
         'status': 1,
         'data': {
             'name': habit.name,
@@ -333,7 +363,56 @@ def get_habit_data():
     })
 
 
+@events.route('/event/cat/get_stats', methods=['POST'])
+@replica_router.read_only
+def get_cat_stats():
+    """Get statistics of all habits of a category, for users to compare themselves with others
+
+    Method Type: POST
+
+    Special Restrictions
+    --------------------
+    User must be logged in
+    Category must exist
+
+    JSON Parameters
+    ---------------
+    auth_token : str
+        Token to authorize the request - released when logging in
+    cat_id : int
+        ID of the category to get the statistics of
+
+    Returns
+    -------
+    JSON
+        status : int
+            Tells whether or not did the function work - 1 for success, 0 for failure
+        data : dict
+            num_habits : int
+                Number of habits in the category
+            level_index, curr_num : dict
+                mean and std of the metric over all habits of the category, null if there are none
+                histogram - list of buckets with min (null if unbounded), max (null if unbounded) and count
+    """
+    request_json = request.get_json()
+
+    auth_token = request_json['auth_token']
+    user = User.verify_auth_token(auth_token)
+
+    if user is None:
+        return json_response({'status': 0, 'error': "User Not Authenticated"})
+
+    cat_id = request_json['cat_id']
+    cat = Category.query.filter_by(id=cat_id).first()
+
+    if not cat:
+        return json_response({'status': 0, 'error': "Category Not Found"})
+
+    return json_response({'status': 1, 'data': get_category_stats(cat_id)})
+
+
 @events.route('/event/cat/get_sorted', methods=['POST'])
+@replica_router.read_only
 def get_sorted_cat():
     """Get sorted list of all category names based on how close they are related to provided text
 
@@ -365,7 +444,7 @@ def get_sorted_cat():
     user = User.verify_auth_token(auth_token)
 
     if user is None:
-        return json.dumps({'status': 0, 'error': "User Not Authenticated"})
+        return json_response({'status': 0, 'error': "User Not Authenticated"})
 
     text_to_compare = request_json['text']
 
@@ -375,31 +454,32 @@ def get_sorted_cat():
     marked_cat = []
 
     for cat in effective_cat:
-        request_data = requests.post('http://api.cortical.io/rest/compare?retina_name=en_associative', json=
-        [
-            {
-                'text': cat[0]
-            },
-            {
-                'text': text_to_compare
-            }
-        ]
-                                     )
-        data = request_data.json()
         try:
+            request_data = requests.post('http://api.cortical.io/rest/compare?retina_name=en_associative', json=
+            [
+                {
+                    'text': cat[0]
+                },
+                {
+                    'text': text_to_compare
+                }
+            ],
+                                         timeout=current_app.config['CORTICAL_TIMEOUT_SECONDS'])
+            data = request_data.json()
             marked_cat.append((data['weightedScoring'], cat[0], cat[1]))
         except Exception:
             marked_cat.append((0, cat[0], cat[1]))
 
     marked_cat.sort(reverse=True)
 
-    return json.dumps({
+    return json_response({
         'status': 1,
         'data': marked_cat
     })
 
 
 @events.route('/event/habit/get_all', methods=['POST'])
+@replica_router.read_only
 def get_all_user_habits():
     """Get data of all habits registered by the logged in user
 
@@ -427,9 +507,10 @@ def get_all_user_habits():
     user = User.verify_auth_token(auth_token)
 
     if user is None:
-        return json.dumps({'status': 0, 'error': "User Not Authenticated"})
+        return json_response({'status': 0, 'error': "User Not Authenticated"})
 
-    all_habits = Habit.query.filter_by(user_id=user.id)
+    all_habits = rows(HabitRow, project(HabitRow, Habit.user_id == user.id))
+    local_today = get_local_today(user.timezone, datetime.utcnow())
 
     habit_list = []
 
@@ -441,9 +522,127 @@ def get_all_user_habits():
             'init_num': habit.init_num,
             'pref_level': habit.pref_level,
             'curr_target': habit.curr_target,
-            'num_today': get_habit_activity_data(datetime.strptime(datetime.now().strftime("%m-%d-%y"), "%m-%d-%y"), 7,
-                                                 habit.id),
+            'num_today': get_habit_activity_data(local_today, 7, habit.id, user.timezone),
             'cat_id': habit.cat_id
         })
 
-    return json.dumps({'status': 1, 'data': habit_list})
+    return json_response({'status': 1, 'data': habit_list})
+
+
+@events.route('/event/habit/forecast', methods=['POST'])
+@replica_router.read_only
+def forecast_user_habits():
+    """Forecast when a habit, or all habits of the logged in user, will reach the ideal number of their category
+
+    Method Type: POST
+
+    Special Restrictions
+    --------------------
+    User must be logged in
+    Habit must exist, if provided
+    Habit must belong to user logged in, if provided
+
+    JSON Parameters
+    ---------------
+    auth_token : str
+        Token to authorize the request - released when logging in
+    habit_id : int, optional
+        ID of the habit to forecast - all habits of the user are forecast if not provided
+    num_days : int, optional
+        Number of days to project ahead - defaults to 90, capped at 365
+    adherence : list of float, optional
+        Scenarios to forecast, as the probability of sticking to the target on any given day - defaults to
+        [1.0, 0.9, 0.75], at most 5 scenarios
+    num_samples : int, optional
+        Number of Monte Carlo samples per habit and scenario - defaults to 100, capped at 1000 and lowered further
+        when forecasting many habits, scenarios or days
+
+    Returns
+    -------
+    JSON
+        status : int
+            Tells whether or not did the function work - 1 for success, 0 for failure
+        data : list of dicts specifying the forecast of each habit under each scenario, and the number of samples
+            drawn for it
+            Bands hold the 10th, 50th and 90th percentiles - days are null where the ideal is not reached
+    """
+    request_json = request.get_json()
+
+    auth_token = request_json['auth_token']
+    user = User.verify_auth_token(auth_token)
+
+    if user is None:
+        return json_response({'status': 0, 'error': "User Not Authenticated"})
+
+    habit_query = db.session.query(Habit.id, Habit.curr_num, Habit.change_index, Category.ideal_num).join(
+        Category, Habit.cat_id == Category.id).filter(Habit.user_id == user.id)
+
+    habit_id = request_json.get('habit_id')
+    if habit_id is not None:
+        habit = Habit.query.filter_by(id=habit_id).first()
+
+        if not habit:
+            return json_response({'status': 0, 'error': "Habit Not Found"})
+
+        if user.id != habit.user_id:
+            return json_response({'status': 0, 'error': "The selected habit does not belong to the logged in user."})
+
+        habit_query = habit_query.filter(Habit.id == habit_id)
+
+    num_days = min(int(request_json.get('num_days', 90)), 365)
+    adherence_levels = [float(x) for x in request_json.get('adherence', [1.0, 0.9, 0.75])]
+    num_samples = min(int(request_json.get('num_samples', 100)), 1000)
+
+    if num_days < 1 or num_samples < 1 or not adherence_levels or not all(0 <= x <= 1 for x in adherence_levels) \
+            or len(adherence_levels) > current_app.config['FORECAST_MAX_SCENARIOS']:
+        return json_response({'status': 0, 'error': "Invalid Forecast Parameters"})
+
+    habit_rows = habit_query.all()
+
+    # The simulation costs one step per scenario, sample, habit and day - fewer samples keep it within the budget
+    steps_per_sample = len(adherence_levels) * max(len(habit_rows), 1) * num_days
+    num_samples = min(num_samples, current_app.config['FORECAST_MAX_STEPS'] // steps_per_sample)
+    if num_samples < 1:
+        return json_response({'status': 0, 'error': "Too Many Habits To Forecast"})
+
+    forecast_list = get_forecast_data(habit_rows, num_days, adherence_levels, num_samples)
+
+    return json_response({'status': 1, 'data': forecast_list})
+
+
+@events.route('/event/stream', methods=['GET'])
+def stream_habit_events():
+    """Stream changes to the habits of the logged in user as Server-Sent Events, replacing polling
+
+    Method Type: GET
+
+    Special Restrictions
+    --------------------
+    User must be logged in
+
+    Query Parameters
+    ----------------
+    auth_token : str
+        Token to authorize the request - released when logging in
+
+    Returns
+    -------
+    text/event-stream
+        ready : sent once connected
+        activity : activity was reported to a habit - habit_id, date (MM-DD-YY, local to the user)
+        habit_added : a habit was attached - same fields as in get_all_user_habits, without num_today
+        habit_settled : the nightly update changed a habit - id, curr_num, curr_target
+        resync : events were dropped because the client fell behind - all data must be fetched again
+    """
+    user = User.verify_auth_token(request.args.get('auth_token'))
+
+    if user is None:
+        return json_response({'status': 0, 'error': "User Not Authenticated"})
+
+    events_stream = habit_event_stream.stream(user.id)
+
+    # The stream may stay open for minutes, and must not keep a database connection checked out meanwhile
+    db.session.close()
+
+    return Response(stream_with_context(events_stream), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,190 @@
+import math
+from bisect import bisect_right
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+
+from backend import db
+from backend.models import Habit, CategoryStat, CategoryStatBucket
+
+# Bucket edges of the histogram kept for every metric - bucket 0 holds values below the first edge, bucket i values
+# in [edges[i - 1], edges[i]) and the last bucket values from the last edge up
+STAT_BUCKET_EDGES = {
+    'level_index': [i / 10 for i in range(11)],
+    'curr_num': [0, 1, 2, 5, 10, 20, 50, 100]
+}
+
+# Relative difference between stored and recomputed sums still put down to floating point rounding
+DRIFT_TOLERANCE = 1e-9
+
+
+def get_habit_metrics(curr_num, init_num):
+    return {
+        'level_index': (init_num - curr_num) / init_num if init_num else 0,
+        'curr_num': curr_num
+    }
+
+
+def get_bucket(metric, value):
+    return bisect_right(STAT_BUCKET_EDGES[metric], value)
+
+
+def update_category_stats(cat_id, old_metrics, new_metrics):
+    """Applies the change of one habit to the statistics of its category, within the current transaction
+
+    old_metrics is None for a newly attached habit, new_metrics None for a removed one. Updates are relative so that
+    concurrent changes to the same category do not overwrite each other.
+    """
+    update_category_stats_many([(cat_id, old_metrics, new_metrics)])
+
+
+def update_category_stats_many(changes):
+    """Applies the changes of many habits, given as (cat_id, old_metrics, new_metrics), with one update per
+    statistic and histogram bucket they touch"""
+    stat_changes = {}
+    bucket_changes = {}
+
+    for cat_id, old_metrics, new_metrics in changes:
+        for metric in STAT_BUCKET_EDGES:
+            old_value = old_metrics[metric] if old_metrics is not None else None
+            new_value = new_metrics[metric] if new_metrics is not None else None
+
+            count, total, total_squares = stat_changes.get((cat_id, metric), (0, 0, 0))
+            stat_changes[(cat_id, metric)] = (count + (new_value is not None) - (old_value is not None),
+                                              total + (new_value or 0) - (old_value or 0),
+                                              total_squares + (new_value or 0) ** 2 - (old_value or 0) ** 2)
+
+            old_bucket = get_bucket(metric, old_value) if old_value is not None else None
+            new_bucket = get_bucket(metric, new_value) if new_value is not None else None
+            if old_bucket != new_bucket:
+                if old_bucket is not None:
+                    key = (cat_id, metric, old_bucket)
+                    bucket_changes[key] = bucket_changes.get(key, 0) - 1
+                if new_bucket is not None:
+                    key = (cat_id, metric, new_bucket)
+                    bucket_changes[key] = bucket_changes.get(key, 0) + 1
+
+    for (cat_id, metric), (count, total, total_squares) in stat_changes.items():
+        increment(CategoryStat, {'cat_id': cat_id, 'metric': metric},
+                  count=count, total=total, total_squares=total_squares)
+    for (cat_id, metric, bucket), count in bucket_changes.items():
+        if count:
+            increment(CategoryStatBucket, {'cat_id': cat_id, 'metric': metric, 'bucket': bucket}, count=count)
+
+
+def increment(model, key, **changes):
+    table = model.__table__
+    statement = table.update().values({name: table.c[name] + change for name, change in changes.items()})
+    for name, value in key.items():
+        statement = statement.where(table.c[name] == value)
+    if db.session.execute(statement).rowcount:
+        return
+    # Another transaction may create the row in between - the insert then fails on the key and the update is retried,
+    # inside a savepoint so that the failed insert does not take down the rest of the transaction
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(dict(key, **changes)))
+    except IntegrityError:
+        db.session.execute(statement)
+
+
+def get_category_stats(cat_id):
+    """Reads the statistics of a category - a fixed number of rows, however many habits it holds"""
+    stats = {}
+
+    for metric, edges in STAT_BUCKET_EDGES.items():
+        stats[metric] = {'mean': None, 'std': None,
+                         'histogram': [{'min': ([None] + edges)[i], 'max': (edges + [None])[i], 'count': 0}
+                                       for i in range(len(edges) + 1)]}
+
+    num_habits = 0
+    for stat in CategoryStat.query.filter_by(cat_id=cat_id):
+        if stat.metric in stats and stat.count > 0:
+            mean = stat.total / stat.count
+            stats[stat.metric]['mean'] = mean
+            stats[stat.metric]['std'] = math.sqrt(max(stat.total_squares / stat.count - mean ** 2, 0))
+            num_habits = stat.count
+
+    for bucket in CategoryStatBucket.query.filter_by(cat_id=cat_id):
+        if bucket.metric in stats:
+            # Buckets only go negative when habits were removed that were never counted in - an empty bucket is
+            # the closest thing to the truth
+            stats[bucket.metric]['histogram'][bucket.bucket]['count'] = max(bucket.count, 0)
+
+    stats['num_habits'] = num_habits
+    return stats
+
+
+def rebuild_category_stats():
+    """Recomputes the statistics of every category from its habits and replaces the stored ones
+
+    Meant for quiet hours - habits changing while it runs may be counted twice or not at all until the next run.
+
+    Returns
+    -------
+    list of tuple
+        (cat_id, metric) of every stored statistic that had drifted from the recomputed one
+    """
+    stat_rows = {}
+    bucket_rows = {}
+
+    for cat_id, curr_num, init_num in db.session.query(Habit.cat_id, Habit.curr_num, Habit.init_num):
+        for metric, value in get_habit_metrics(curr_num, init_num).items():
+            count, total, total_squares = stat_rows.get((cat_id, metric), (0, 0, 0))
+            stat_rows[(cat_id, metric)] = (count + 1, total + value, total_squares + value ** 2)
+            bucket_key = (cat_id, metric, get_bucket(metric, value))
+            bucket_rows[bucket_key] = bucket_rows.get(bucket_key, 0) + 1
+
+    drifted = set()
+
+    stored_stats = {(x.cat_id, x.metric): (x.count, x.total, x.total_squares) for x in CategoryStat.query}
+    for key in set(stored_stats) | set(stat_rows):
+        stored = stored_stats.get(key, (0, 0, 0))
+        rebuilt = stat_rows.get(key, (0, 0, 0))
+        if stored[0] != rebuilt[0] or not all(math.isclose(a, b, rel_tol=DRIFT_TOLERANCE, abs_tol=DRIFT_TOLERANCE)
+                                              for a, b in zip(stored[1:], rebuilt[1:])):
+            drifted.add(key)
+
+    stored_buckets = {(x.cat_id, x.metric, x.bucket): x.count for x in CategoryStatBucket.query}
+    for key in set(stored_buckets) | set(bucket_rows):
+        if stored_buckets.get(key, 0) != bucket_rows.get(key, 0):
+            drifted.add(key[:2])
+
+    CategoryStat.query.delete()
+    CategoryStatBucket.query.delete()
+    for (cat_id, metric), (count, total, total_squares) in stat_rows.items():
+        db.session.add(CategoryStat(cat_id=cat_id, metric=metric, count=count, total=total,
+                                    total_squares=total_squares))
+    for (cat_id, metric, bucket), count in bucket_rows.items():
+        db.session.add(CategoryStatBucket(cat_id=cat_id, metric=metric, bucket=bucket, count=count))
+    db.session.commit()
+
+    return sorted(drifted)
+
+
+def backfill_category_stats():
+    """Builds the statistics of every category from its habits if none are stored yet
+
+    Habits that existed before the statistics tables were created are otherwise never counted in, while every change
+    to them is - settling them would only ever subtract from the statistics.
+
+    Returns
+    -------
+    bool
+        Whether the statistics were built
+    """
+    if db.session.query(CategoryStat.query.exists()).scalar() or not db.session.query(Habit.query.exists()).scalar():
+        return False
+    rebuild_category_stats()
+    return True
+
+
+@click.command('reconcile-category-stats')
+@with_appcontext
+def reconcile_category_stats_command():
+    """Rebuild the category statistics from scratch and report drift."""
+    drifted = rebuild_category_stats()
+    for cat_id, metric in drifted:
+        click.echo('Drift in {} of category {}'.format(metric, cat_id))
+    click.echo('Rebuilt category statistics, {} had drifted'.format(len(drifted)))
@@ -1,29 +1,143 @@
-from datetime import timedelta
-from backend.models import Activity, Habit
-from sqlalchemy import and_
+from datetime import datetime, time, timedelta
+from backend.models import Activity, Habit, User
+from sqlalchemy import and_, select, bindparam
+from pytz import all_timezones, timezone, utc
 import random
 import math
-from backend import db
+from backend import db, activity_shards, activity_archive, habit_event_stream
+from backend.archive import EPOCH
+from backend.events.forecast import forecast_habits
+from backend.events.stats import get_habit_metrics, update_category_stats_many
+from backend.projections import SettlementRow, project, rows
 
+HABIT_SETTLEMENT = Habit.__table__.update().where(Habit.id == bindparam('habit_id')).values(
+    curr_num=bindparam('new_num'), curr_target=bindparam('new_target'))
 
-def get_habit_activity_data(test_date, num_days, habit_id):
-    num_days_ago = test_date - timedelta(days=num_days)
+USER_SETTLEMENT = User.__table__.update().where(User.id == bindparam('user_id')).values(
+    last_settled_day=bindparam('settled_day'))
 
-    all_activities = Activity.query.filter(and_(Activity.habit_id == habit_id,
-                                                and_(Activity.timestamp <= test_date,
-                                                     Activity.timestamp >= num_days_ago)))
+
+def get_habit_activity_data(test_date, num_days, habit_id, tz_name='UTC'):
+    """Counts the activities of a habit per local day over the num_days days leading up to test_date
+
+    test_date is a naive datetime in the local time of tz_name, while activity timestamps are stored in UTC. Days
+    that have been archived are read from the activity archive, the rest from the live table.
+    """
+    user_tz = timezone(tz_name)
+    window_end = to_utc(user_tz, test_date)
+    window_start = to_utc(user_tz, test_date - timedelta(days=num_days))
 
     datewise_activity_map = {}
 
-    for each_activity in all_activities:
-        if datewise_activity_map.get(each_activity.timestamp.strftime('%m-%d-%y')) is None:
-            datewise_activity_map[each_activity.timestamp.strftime('%m-%d-%y')] = 1
+    archive = activity_archive.get(habit_id)
+    if archive is not None:
+        datewise_activity_map = archive.get_datewise_counts((test_date.date() - EPOCH).days - num_days,
+                                                            (test_date.date() - EPOCH).days)
+        window_start = max(window_start, archive.archived_until)
+
+    # Only the timestamp is selected so that the (habit_id, timestamp) index covers the whole query
+    all_activities = activity_shards.execute(habit_id, select([Activity.timestamp]).where(
+        and_(Activity.habit_id == habit_id, and_(Activity.timestamp <= window_end,
+                                                 Activity.timestamp >= window_start))))
+
+    for (timestamp,) in all_activities:
+        date_string = utc.localize(timestamp).astimezone(user_tz).strftime('%m-%d-%y')
+        if datewise_activity_map.get(date_string) is None:
+            datewise_activity_map[date_string] = 1
         else:
-            datewise_activity_map[each_activity.timestamp.strftime('%m-%d-%y')] += 1
+            datewise_activity_map[date_string] += 1
 
     return datewise_activity_map
 
 
+def to_utc(user_tz, local_time):
+    """Converts a naive local datetime of user_tz into a naive UTC datetime"""
+    return user_tz.normalize(user_tz.localize(local_time)).astimezone(utc).replace(tzinfo=None)
+
+
+def get_local_today(tz_name, utc_time):
+    """Returns local midnight of the current day in tz_name as a naive datetime"""
+    local_time = utc.localize(utc_time).astimezone(timezone(tz_name))
+    return local_time.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def get_local_date_string(tz_name, utc_time):
+    return utc.localize(utc_time).astimezone(timezone(tz_name)).strftime('%m-%d-%y')
+
+
+def get_settlement_timezones(utc_time):
+    """Returns the names of all timezones whose local day ended during the hour leading up to utc_time
+
+    Users who were never settled are first settled in this hour of their timezone, the one the settlement ran in
+    before settled days were recorded, so that no day settled before is settled again.
+    """
+    aware_time = utc.localize(utc_time)
+    return [tz_name for tz_name in all_timezones if aware_time.astimezone(timezone(tz_name)).hour == 0]
+
+
+def count_day_activities(habit_ids, tz_name, local_day):
+    """Counts the activities of every habit in habit_ids on the local day starting at the naive local midnight
+    local_day, gathered from all activity partitions"""
+    user_tz = timezone(tz_name)
+    day_start = to_utc(user_tz, local_day)
+    day_end = to_utc(user_tz, local_day + timedelta(days=1))
+
+    return activity_shards.count_activities(habit_ids, day_start, day_end)
+
+
+def settle_users(tz_name, settle_days):
+    """Settles the habits of users of tz_name for one local day each and records that day, in one transaction
+
+    Parameters
+    ----------
+    tz_name : str
+        Timezone of all the users
+    settle_days : dict
+        Local date to settle, by user id
+
+    Returns
+    -------
+    int
+        Number of habits settled
+    """
+    settled_habits = rows(SettlementRow, project(SettlementRow, Habit.user_id.in_(list(settle_days))))
+
+    habit_ids_by_day = {}
+    for each_habit in settled_habits:
+        habit_ids_by_day.setdefault(settle_days[each_habit.user_id], []).append(each_habit.id)
+
+    num_times_by_habit = {}
+    for day, habit_ids in habit_ids_by_day.items():
+        num_times_by_habit.update(count_day_activities(habit_ids, tz_name, datetime.combine(day, time())))
+
+    updates = []
+    stat_changes = []
+    for each_habit in settled_habits:
+        num_times = num_times_by_habit.get(each_habit.id, 0)
+        diff = each_habit.curr_target - num_times
+        if diff >= 0:
+            new_num = each_habit.curr_num * each_habit.change_index ** (diff + 1)
+        else:
+            new_num = each_habit.curr_num / each_habit.change_index ** (diff * (-1))
+        updates.append({'habit_id': each_habit.id, 'new_num': new_num, 'new_target': get_new_target(new_num)})
+        stat_changes.append((each_habit.cat_id, get_habit_metrics(each_habit.curr_num, each_habit.init_num),
+                             get_habit_metrics(new_num, each_habit.init_num)))
+
+    if updates:
+        db.session.execute(HABIT_SETTLEMENT, updates)
+        update_category_stats_many(stat_changes)
+    db.session.execute(USER_SETTLEMENT, [{'user_id': user_id, 'settled_day': day}
+                                         for user_id, day in settle_days.items()])
+    db.session.commit()
+
+    for each_habit, update in zip(settled_habits, updates):
+        habit_event_stream.publish(each_habit.user_id, 'habit_settled', {'id': each_habit.id,
+                                                                         'curr_num': update['new_num'],
+                                                                         'curr_target': update['new_target']})
+
+    return len(settled_habits)
+
+
 def get_change_index(cat_level, pref_level):
     init_level = 0.99
 
@@ -36,9 +150,49 @@ def get_change_index(cat_level, pref_level):
     return change_index
 
 
+def get_new_target(curr_num):
+    return math.floor(curr_num + random.random())
+
+
 def set_target(habit_id):
     habit = Habit.query.filter_by(id=habit_id).first()
-    curr_num = habit.curr_num
-    new_target = math.floor(curr_num + random.random())
-    habit.curr_target = new_target
+    habit.curr_target = get_new_target(habit.curr_num)
     db.session.commit()
+
+
+def get_forecast_data(habit_rows, num_days, adherence_levels, num_samples):
+    if not habit_rows:
+        return []
+
+    habit_ids, curr_nums, change_indexes, ideal_nums = zip(*habit_rows)
+    forecast = forecast_habits(curr_nums, change_indexes, ideal_nums, num_days, adherence_levels, num_samples)
+
+    forecast_list = []
+
+    for habit_index, habit_id in enumerate(habit_ids):
+        scenario_list = []
+        for scenario_index, adherence in enumerate(adherence_levels):
+            scenario_list.append({
+                'adherence': adherence,
+                'reach_probability': float(forecast['reach_probability'][scenario_index, habit_index]),
+                'expected_day': to_json_number(forecast['expected_day'][scenario_index, habit_index]),
+                'day_bands': [to_json_number(x) for x in forecast['day_bands'][scenario_index, habit_index]],
+                'curr_num_bands': [to_json_number(x) for x in forecast['num_bands'][scenario_index, habit_index]],
+                'curr_target_bands': [to_json_number(x) for x in
+                                      forecast['target_bands'][scenario_index, habit_index]]
+            })
+        forecast_list.append({
+            'habit_id': habit_id,
+            'ideal_num': ideal_nums[habit_index],
+            'num_days': num_days,
+            'num_samples': num_samples,
+            'scenarios': scenario_list
+        })
+
+    return forecast_list
+
+
+def to_json_number(value):
+    if math.isfinite(value):
+        return float(value)
+    return None
@@ -0,0 +1,201 @@
+import math
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask import current_app, g, request
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+
+from backend.responses import json_response
+
+# Seconds between two sweeps of the token buckets that have refilled, which are dropped to keep the state of every
+# client address ever seen from piling up
+BUCKET_PRUNE_SECONDS = 60
+
+
+class MemoryLimiterStorage:
+    """Limiter state held by the current worker process - shared between its threads only"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._buckets = {}
+
+    def acquire_slot(self, name, limit, ttl):
+        """Takes one of the limit slots of name, returning its token, or None if all slots are taken
+
+        Slots not released within ttl seconds are considered abandoned and freed.
+        """
+        now = time.time()
+        with self._lock:
+            slots = {token: expiry for token, expiry in self._slots.get(name, {}).items() if expiry > now}
+            if len(slots) >= limit:
+                self._slots[name] = slots
+                return None
+            token = uuid.uuid4().hex
+            slots[token] = now + ttl
+            self._slots[name] = slots
+            return token
+
+    def release_slot(self, name, token):
+        with self._lock:
+            self._slots.get(name, {}).pop(token, None)
+
+    def consume(self, key, rate, burst):
+        """Takes a token from the bucket of key, returning 0 on success or the seconds until a token is available"""
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1, now)
+            return 0
+
+    def prune_buckets(self, idle_seconds):
+        """Drops the buckets left untouched for idle_seconds, returning how many - a bucket that has had time to
+        refill is no different from a missing one"""
+        cutoff = time.time() - idle_seconds
+        with self._lock:
+            idle_keys = [key for key, (_, updated) in self._buckets.items() if updated <= cutoff]
+            for key in idle_keys:
+                del self._buckets[key]
+        return len(idle_keys)
+
+
+class SqliteLimiterStorage:
+    """Limiter state kept in a SQLite file, shared by every worker process on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS slot (name TEXT, token TEXT PRIMARY KEY, expiry REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_slot_name ON slot (name, expiry)')
+            connection.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_bucket_updated ON bucket (updated)')
+
+    def _transaction(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return _ImmediateTransaction(connection)
+
+    def acquire_slot(self, name, limit, ttl):
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM slot WHERE name = ? AND expiry <= ?', (name, now))
+            (num_taken,) = connection.execute('SELECT COUNT(*) FROM slot WHERE name = ?', (name,)).fetchone()
+            if num_taken >= limit:
+                return None
+            token = uuid.uuid4().hex
+            connection.execute('INSERT INTO slot (name, token, expiry) VALUES (?, ?, ?)', (name, token, now + ttl))
+            return token
+
+    def release_slot(self, name, token):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM slot WHERE token = ?', (token,))
+
+    def consume(self, key, rate, burst):
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (burst, now)
+            tokens = min(burst, tokens + (now - updated) * rate)
+            retry_after = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not retry_after:
+                tokens -= 1
+            connection.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+            return retry_after
+
+    def prune_buckets(self, idle_seconds):
+        with self._transaction() as connection:
+            return connection.execute('DELETE FROM bucket WHERE updated <= ?', (time.time() - idle_seconds,)).rowcount
+
+
+class _ImmediateTransaction:
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+class AdmissionControl:
+    """Sheds requests to expensive endpoints before they can tie up every worker
+
+    Endpoints listed in RATE_LIMITS get a token bucket per user (per client address before logging in) and answer
+    429 once it is empty. Endpoints listed in ENDPOINT_CONCURRENCY_CLASSES share the concurrency limit of their class
+    in CONCURRENCY_LIMITS and answer 503 once it is reached, so the cheap endpoints always keep workers to run on.
+    Both carry a Retry-After header. The state lives in the SQLite file LIMITER_STORAGE_PATH when set, so that all
+    workers of a host share it, and in the memory of each worker otherwise.
+    """
+
+    def __init__(self, app=None):
+        self.storage = None
+        self._next_prune = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        storage_path = app.config.get('LIMITER_STORAGE_PATH')
+        self.storage = SqliteLimiterStorage(storage_path) if storage_path else MemoryLimiterStorage()
+        app.extensions['admission_control'] = self
+        app.before_request(self.admit)
+        app.teardown_request(self.release)
+
+    def admit(self):
+        config = current_app.config
+        endpoint = request.endpoint
+
+        rate_limit = config.get('RATE_LIMITS', {}).get(endpoint)
+        if rate_limit is not None:
+            rate, burst = rate_limit
+            retry_after = self.storage.consume('{}:{}'.format(endpoint, get_client_key()), rate, burst)
+            if retry_after:
+                return reject(429, "Too Many Requests", retry_after)
+            if time.time() >= self._next_prune:
+                self._next_prune = time.time() + BUCKET_PRUNE_SECONDS
+                # No bucket takes longer than the slowest of the limits to refill
+                self.storage.prune_buckets(max(burst / rate for rate, burst in config['RATE_LIMITS'].values()))
+
+        concurrency_class = config.get('ENDPOINT_CONCURRENCY_CLASSES', {}).get(endpoint)
+        if concurrency_class is not None:
+            limit = config['CONCURRENCY_LIMITS'][concurrency_class]
+            token = self.storage.acquire_slot(concurrency_class, limit, config.get('CONCURRENCY_SLOT_TTL', 120))
+            if token is None:
+                return reject(503, "Server Busy", config.get('CONCURRENCY_RETRY_AFTER', 1))
+            g.admission_slot = (concurrency_class, token)
+
+    def release(self, exception=None):
+        slot = g.pop('admission_slot', None)
+        if slot is not None:
+            self.storage.release_slot(*slot)
+
+
+def get_client_key():
+    """Identifies the user making the request from their auth token without touching the database, falling back to
+    the client address"""
+    request_json = request.get_json(silent=True)
+    if isinstance(request_json, dict) and request_json.get('auth_token'):
+        try:
+            return 'user:{}'.format(Serializer(current_app.config['SECRET_KEY']).loads(
+                request_json['auth_token'])['user_id'])
+        except Exception:
+            pass
+    # remote_addr is taken from X-Forwarded-For by ProxyFix, only as far as TRUSTED_PROXY_HOPS go
+    return 'addr:{}'.format(request.remote_addr)
+
+
+def reject(status_code, error, retry_after):
+    return json_response({'status': 0, 'error': error}, status_code, {'Retry-After': str(math.ceil(retry_after))})
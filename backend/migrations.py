@@ -0,0 +1,111 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_sqlalchemy import get_state
+from sqlalchemy import inspect
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateColumn
+
+
+def create_missing_columns(engine, metadata):
+    """Adds every column declared on the models that is missing from an existing table
+
+    Columns added this way must either be nullable or carry a server default so that existing rows stay valid. A column
+    another process adds in the meantime is skipped rather than failing.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        Engine connected to the database to upgrade
+    metadata : sqlalchemy.MetaData
+        Metadata holding the table (and column) definitions of the models
+
+    Returns
+    -------
+    list of str
+        Names of the columns that were created, formatted as table.column
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    created = []
+
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_spec = CreateColumn(column).compile(dialect=engine.dialect)
+                table_name = engine.dialect.identifier_preparer.format_table(table)
+                try:
+                    engine.execute('ALTER TABLE {} ADD COLUMN {}'.format(table_name, column_spec))
+                except DBAPIError:
+                    if column.name not in {x['name'] for x in inspect(engine).get_columns(table.name)}:
+                        raise
+                    continue
+                created.append('{}.{}'.format(table.name, column.name))
+
+    return created
+
+
+def create_missing_indexes(engine, metadata):
+    """Creates every index declared on the models that is missing from the database
+
+    db.create_all only creates tables that do not exist yet, so indexes added to an already deployed table have to
+    be created separately. Running this more than once is safe - existing indexes are left untouched, and so are
+    indexes another process creates in the meantime.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        Engine connected to the database to upgrade
+    metadata : sqlalchemy.MetaData
+        Metadata holding the table (and index) definitions of the models
+
+    Returns
+    -------
+    list of str
+        Names of the indexes that were created
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    created = []
+
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                try:
+                    index.create(bind=engine)
+                except DBAPIError:
+                    if index.name not in {x['name'] for x in inspect(engine).get_indexes(table.name)}:
+                        raise
+                    continue
+                created.append(index.name)
+
+    return created
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Create the tables, columns and indexes missing from the deployed database, and fill in derived data."""
+    from backend.events.stats import backfill_category_stats
+
+    db = get_state(current_app).db
+    db.create_all(bind=None)
+    current_app.extensions['activity_shards'].create_tables()
+    created = create_missing_columns(db.get_engine(current_app), db.metadata)
+    created += create_missing_indexes(db.get_engine(current_app), db.metadata)
+    for bind_key in current_app.extensions['activity_shards'].binds:
+        if bind_key is not None:
+            created += create_missing_indexes(db.get_engine(current_app, bind=bind_key), db.metadata)
+    for name in created:
+        click.echo('Created {}'.format(name))
+    if backfill_category_stats():
+        click.echo('Built the category statistics of the existing habits')
+    click.echo('Database is up to date, {} columns and indexes created'.format(len(created)))
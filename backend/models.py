@@ -1,4 +1,4 @@
-from backend import db
+from backend import db, replica_router
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask_login import UserMixin
 from flask import current_app
@@ -8,11 +8,19 @@ from datetime import datetime
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(127), nullable=False)
-    email = db.Column(db.String(63), unique=False, nullable=False)
+    email = db.Column(db.String(63), unique=False, nullable=False, index=True)
     password = db.Column(db.String(63), unique=False, nullable=False)
     isAdmin = db.Column(db.Boolean, nullable=False, default=False)
     isSnap = db.Column(db.Boolean, nullable=False, default=False)
     snapPic = db.Column(db.String(255), nullable=True)
+    timezone = db.Column(db.String(63), nullable=False, default='UTC', server_default='UTC')
+    # Last local day the habits of the user were settled for - None until the first settlement
+    last_settled_day = db.Column(db.Date, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_user_name_snap_pic', 'name', 'snapPic'),
+        db.Index('ix_user_timezone_last_settled_day', 'timezone', 'last_settled_day'),
+    )
 
     def get_auth_token(self, expires_seconds=86400):
         s = Serializer(current_app.config['SECRET_KEY'], expires_seconds)
@@ -25,6 +33,7 @@ class User(db.Model, UserMixin):
             user_id = s.loads(token)['user_id']
         except:
             return None
+        replica_router.identify(user_id)
         return User.query.get(user_id)
 
     def get_reset_token(self, expires_seconds=1800):
@@ -52,7 +61,7 @@ class Habit(db.Model):
     pref_level = db.Column(db.Integer, nullable=False)
     change_index = db.Column(db.Float, nullable=False)
     curr_target = db.Column(db.Integer, nullable=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     cat_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
 
 
@@ -63,7 +72,40 @@ class Category(db.Model):
     ideal_num = db.Column(db.Integer, nullable=False)
 
 
+class CategoryStat(db.Model):
+    cat_id = db.Column(db.Integer, db.ForeignKey('category.id'), primary_key=True)
+    metric = db.Column(db.String(31), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0)
+    total_squares = db.Column(db.Float, nullable=False, default=0)
+
+
+class CategoryStatBucket(db.Model):
+    cat_id = db.Column(db.Integer, db.ForeignKey('category.id'), primary_key=True)
+    metric = db.Column(db.String(31), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Activity(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    habit_id = db.Column(db.Integer, db.ForeignKey('habit.id'), nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.now(), nullable=False)
+    # No foreign key - activity may be partitioned into databases that do not hold the habit table
+    habit_id = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_activity_habit_id_timestamp', 'habit_id', 'timestamp'),
+    )
+
+
+# Activity row copied to the partition owning its habit by a rebalance but not yet deleted from the partition it came
+# from - kept on the owning partition, so that a rebalance interrupted at any point copies every row exactly once
+class ActivityMove(db.Model):
+    source_bind = db.Column(db.String(63), primary_key=True)
+    source_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    habit_id = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_activity_move_source_bind_habit_id', 'source_bind', 'habit_id'),
+    )
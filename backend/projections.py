@@ -0,0 +1,86 @@
+from backend import db
+from backend.models import Habit, User
+
+# Number of rows fetched per round trip by iter_chunks and iter_drained
+CHUNK_SIZE = 1000
+
+
+class HabitRow:
+    """Read-only copy of the columns of a habit - not tracked by the session, and a fraction of the size of a Habit"""
+
+    __slots__ = ('id', 'name', 'curr_num', 'init_num', 'pref_level', 'change_index', 'curr_target', 'user_id',
+                 'cat_id')
+
+    columns = (Habit.id, Habit.name, Habit.curr_num, Habit.init_num, Habit.pref_level, Habit.change_index,
+               Habit.curr_target, Habit.user_id, Habit.cat_id)
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+
+class SettlementUserRow:
+    """Users the hourly settlement walks through, one timezone at a time"""
+
+    __slots__ = ('id', 'last_settled_day')
+
+    columns = (User.id, User.last_settled_day)
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+
+class SettlementRow:
+    """Columns the settlement needs of a habit"""
+
+    __slots__ = ('id', 'user_id', 'cat_id', 'curr_num', 'init_num', 'change_index', 'curr_target')
+
+    columns = (Habit.id, Habit.user_id, Habit.cat_id, Habit.curr_num, Habit.init_num, Habit.change_index,
+               Habit.curr_target)
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+
+def project(row_class, *criteria):
+    """Returns a query of only the columns of row_class - iterate it through rows, iter_chunks or iter_drained"""
+    return db.session.query(*row_class.columns).filter(*criteria)
+
+
+def rows(row_class, query):
+    return [row_class(*values) for values in query]
+
+
+def iter_chunks(row_class, query, key_column, chunk_size=CHUNK_SIZE):
+    """Yields the rows of a projection query in lists of at most chunk_size, ordered by key_column
+
+    Every chunk is a separate query resuming after the last key of the previous one, so only one chunk is held in
+    memory and the session may be written to and committed between chunks. The criteria of the query must be served
+    by an index delivering rows in key_column order, such as an equality on an indexed column with the primary key as
+    key_column - otherwise every chunk reads and sorts all remaining rows.
+    """
+    key_index = next(i for i, column in enumerate(row_class.columns) if column is key_column)
+    last_key = None
+    while True:
+        chunk_query = query if last_key is None else query.filter(key_column > last_key)
+        chunk = chunk_query.order_by(key_column).limit(chunk_size).all()
+        if not chunk:
+            return
+        last_key = chunk[-1][key_index]
+        yield [row_class(*values) for values in chunk]
+
+
+def iter_drained(row_class, query, chunk_size=CHUNK_SIZE):
+    """Yields the rows of a projection query in lists of at most chunk_size, for callers that change every row they
+    are given so that it no longer matches the query
+
+    Every chunk is read from the start of the query again, so an index on its criteria serves it without sorting and
+    without skipping past rows already handled. Rows left matching are yielded again.
+    """
+    while True:
+        chunk = query.limit(chunk_size).all()
+        if not chunk:
+            return
+        yield [row_class(*values) for values in chunk]
@@ -0,0 +1,80 @@
+import gzip
+import io
+import json
+
+from flask import current_app, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def dumps(data):
+    """Serializes data to JSON bytes - with orjson when it is installed, the standard library otherwise"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(data, status=200, headers=None):
+    """Returns data as an application/json response"""
+    return current_app.response_class(dumps(data), status, headers, mimetype='application/json')
+
+
+def gzip_compress(body, level):
+    # Written through GzipFile with a fixed mtime so the same body always compresses to the same bytes
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level, mtime=0) as gzip_file:
+        gzip_file.write(body)
+    return buffer.getvalue()
+
+
+class ResponseCompression:
+    """Compresses responses of COMPRESS_MIMETYPES of at least COMPRESS_MIN_SIZE bytes for clients accepting it
+
+    Brotli is preferred when the brotli package is installed and the client ranks it no lower than gzip. Streamed
+    responses, such as the event stream, are left alone.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['response_compression'] = self
+        app.after_request(self.compress)
+
+    @staticmethod
+    def get_encodings():
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def compress(self, response):
+        config = current_app.config
+        if response.mimetype not in config.get('COMPRESS_MIMETYPES', ()) or response.direct_passthrough \
+                or response.is_streamed or 'Content-Encoding' in response.headers:
+            return response
+
+        # The body depends on Accept-Encoding whether or not this one ends up compressed
+        response.vary.add('Accept-Encoding')
+
+        if response.content_length is None or response.content_length < config.get('COMPRESS_MIN_SIZE', 1024):
+            return response
+
+        encoding = request.accept_encodings.best_match(self.get_encodings())
+        if encoding is None:
+            return response
+
+        if encoding == 'br':
+            body = brotli.compress(response.get_data(), quality=config.get('COMPRESS_BROTLI_QUALITY', 5))
+        else:
+            body = gzip_compress(response.get_data(), config.get('COMPRESS_GZIP_LEVEL', 6))
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
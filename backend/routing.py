@@ -0,0 +1,149 @@
+import itertools
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from itsdangerous import BadSignature, TimestampSigner
+from sqlalchemy import orm
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.dml import UpdateBase
+
+# Cookie and header carrying the token of the last write of a client
+LAST_WRITE_COOKIE = 'habby_last_write'
+LAST_WRITE_HEADER = 'X-Habby-Last-Write'
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends the reads of read-only endpoints to a replica and everything else to the primary"""
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get('replica_router')
+        if router is not None:
+            if self._flushing or isinstance(clause, UpdateBase):
+                router.record_write()
+            else:
+                replica_bind = router.get_read_bind()
+                if replica_bind is not None:
+                    return get_state(self.app).db.get_engine(self.app, bind=replica_bind)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter:
+    """Picks the database bind used by every request
+
+    Endpoints decorated with read_only read from the replica binds listed in SQLALCHEMY_REPLICA_BINDS, chosen round
+    robin for each request. Everything else - including every flush - goes to the primary. A user who wrote within the
+    last REPLICA_STALENESS_SECONDS reads from the primary as well, so they always see their own changes. A replica
+    that fails is skipped for REPLICA_RETRY_SECONDS and the request is retried on the primary.
+
+    Writes are remembered by the client rather than the server - every response to a write carries a signed, timed
+    token as the LAST_WRITE_COOKIE cookie and the LAST_WRITE_HEADER header, and a request sending either back is
+    matched up with its write on whichever instance it lands.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._unhealthy_until = {}
+        self._counter = itertools.count()
+        self.replica_binds = []
+        self.staleness_seconds = 0
+        self.retry_seconds = 0
+        self.signer = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.replica_binds = list(app.config.get('SQLALCHEMY_REPLICA_BINDS', []))
+        self.staleness_seconds = app.config.get('REPLICA_STALENESS_SECONDS', 5)
+        self.retry_seconds = app.config.get('REPLICA_RETRY_SECONDS', 30)
+        self.signer = TimestampSigner(app.config['SECRET_KEY'], salt='replica-router-last-write')
+        app.extensions['replica_router'] = self
+        app.before_request(self.reset_request_state)
+        app.after_request(self.send_last_write)
+
+    @staticmethod
+    def reset_request_state():
+        # g outlives a request whenever an app context was already pushed, as in tests and scripts
+        for key in ('user_id', 'read_only', 'wrote', 'replica_bind'):
+            g.pop(key, None)
+
+    def identify(self, user_id):
+        """Records the user making the current request, so their writes and reads can be matched up"""
+        if has_request_context():
+            g.user_id = user_id
+
+    def record_write(self):
+        if has_request_context():
+            g.wrote = True
+
+    def send_last_write(self, response):
+        """Hands the client of a request that wrote the token proving it, for its next requests to send back"""
+        if g.get('wrote'):
+            token = self.signer.sign(str(g.get('user_id', ''))).decode('utf-8')
+            response.set_cookie(LAST_WRITE_COOKIE, token, max_age=self.staleness_seconds, httponly=True)
+            response.headers[LAST_WRITE_HEADER] = token
+        return response
+
+    def wrote_recently(self):
+        """Tells whether the current request sent back the token of a write by its user that may not have reached
+        the replicas yet"""
+        token = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+        if not token:
+            return False
+        try:
+            user_id = self.signer.unsign(token, max_age=self.staleness_seconds).decode('utf-8')
+        except BadSignature:
+            return False
+        return user_id in ('', str(g.get('user_id', '')))
+
+    def get_read_bind(self):
+        """Returns the replica bind to read from, or None if the current read must go to the primary"""
+        if not has_request_context() or not g.get('read_only') or g.get('wrote'):
+            return None
+
+        if 'replica_bind' in g:
+            return g.replica_bind
+
+        if self.wrote_recently():
+            return None
+
+        now = time.monotonic()
+
+        with self._lock:
+            healthy_binds = [x for x in self.replica_binds if self._unhealthy_until.get(x, 0) <= now]
+            if not healthy_binds:
+                return None
+            replica_bind = healthy_binds[next(self._counter) % len(healthy_binds)]
+
+        g.replica_bind = replica_bind
+        return replica_bind
+
+    def mark_unhealthy(self, replica_bind):
+        with self._lock:
+            self._unhealthy_until[replica_bind] = time.monotonic() + self.retry_seconds
+
+    def read_only(self, view):
+        """Decorator marking an endpoint whose reads may be served by a replica"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.read_only = True
+            try:
+                return view(*args, **kwargs)
+            except OperationalError:
+                replica_bind = g.pop('replica_bind', None)
+                if replica_bind is None:
+                    raise
+                self.mark_unhealthy(replica_bind)
+                g.read_only = False
+                get_state(current_app).db.session.rollback()
+                return view(*args, **kwargs)
+
+        return wrapper
@@ -0,0 +1,174 @@
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_sqlalchemy import get_state
+from sqlalchemy import select, func
+
+# Number of habit IDs sent to a partition in a single IN clause
+SCATTER_CHUNK_SIZE = 500
+
+
+class ActivityShards:
+    """Hash partitions the activity table over the binds listed in ACTIVITY_SHARD_BINDS
+
+    Every habit is owned by exactly one partition, chosen by rendezvous hashing of its ID - adding or removing a bind
+    only moves the habits it gains or loses, which the rebalance-activity command then copies over. Without any
+    configured binds the activity table stays on the primary database and goes through the replica routing.
+    """
+
+    def __init__(self, app=None, table_name='activity', move_table_name='activity_move'):
+        self.table_name = table_name
+        self.move_table_name = move_table_name
+        self.binds = [None]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.binds = list(app.config.get('ACTIVITY_SHARD_BINDS', [])) or [None]
+        app.extensions['activity_shards'] = self
+        app.cli.add_command(rebalance_activity_command)
+
+    @property
+    def table(self):
+        return get_state(current_app).db.metadata.tables[self.table_name]
+
+    @property
+    def move_table(self):
+        return get_state(current_app).db.metadata.tables[self.move_table_name]
+
+    @staticmethod
+    def get_engine(bind_key):
+        return get_state(current_app).db.get_engine(current_app, bind=bind_key)
+
+    def get_bind_key(self, habit_id):
+        """Returns the bind owning the activity of a habit"""
+        return max(self.binds, key=lambda bind_key: zlib.crc32('{}:{}'.format(bind_key, habit_id).encode('utf-8')))
+
+    def execute(self, habit_id, statement):
+        """Executes a statement touching only the activity of habit_id through the session, on the owning partition"""
+        session = get_state(current_app).db.session
+        bind_key = self.get_bind_key(habit_id)
+        if bind_key is None:
+            return session.execute(statement)
+        return session.execute(statement, bind=self.get_engine(bind_key))
+
+    def scatter(self, habit_ids, make_statement):
+        """Runs a statement on every partition owning some of habit_ids, in parallel, and gathers all rows
+
+        make_statement receives the habit IDs of one partition (at most SCATTER_CHUNK_SIZE of them at a time) and
+        returns the statement to run there. The partitions are queried outside of the session.
+        """
+        work = []
+        habit_ids_by_bind = {}
+        for habit_id in habit_ids:
+            habit_ids_by_bind.setdefault(self.get_bind_key(habit_id), []).append(habit_id)
+        for bind_key, bind_habit_ids in habit_ids_by_bind.items():
+            engine = self.get_engine(bind_key)
+            for i in range(0, len(bind_habit_ids), SCATTER_CHUNK_SIZE):
+                work.append((engine, make_statement(bind_habit_ids[i:i + SCATTER_CHUNK_SIZE])))
+
+        if not work:
+            return []
+
+        def run(engine_statement):
+            engine, statement = engine_statement
+            with engine.connect() as connection:
+                return connection.execute(statement).fetchall()
+
+        with ThreadPoolExecutor(max_workers=min(len(work), len(self.binds))) as executor:
+            return [row for rows in executor.map(run, work) for row in rows]
+
+    def create_tables(self):
+        """Creates the activity tables, along with their indexes, on every partition other than the primary that lacks
+        them - indexes added later are created by the upgrade-db command"""
+        for bind_key in self.binds:
+            if bind_key is not None:
+                engine = self.get_engine(bind_key)
+                self.table.create(bind=engine, checkfirst=True)
+                self.move_table.create(bind=engine, checkfirst=True)
+
+    def rebalance(self, drain_binds=()):
+        """Moves the activity of every habit sitting on a partition that does not own it to the owning partition
+
+        Partitions are scanned one habit at a time. For every misplaced habit the rows are copied to the owner, along
+        with a record of the source row each copy came from, and only then deleted from the source by ID. A copy
+        interrupted at any point is picked up where it stopped when the command is run again - rows already recorded
+        as copied are not copied twice, and rows on the owner that did not come from the source are never touched.
+
+        Parameters
+        ----------
+        drain_binds : sequence of str or None
+            Binds to empty that are no longer part of ACTIVITY_SHARD_BINDS - None stands for the primary database
+
+        Returns
+        -------
+        int
+            Number of rows moved
+        """
+        table = self.table
+        moves = self.move_table
+        num_moved = 0
+
+        for source_key in list(dict.fromkeys(self.binds + list(drain_binds))):
+            source = self.get_engine(source_key)
+            source_name = source_key or 'primary'
+            table.create(bind=source, checkfirst=True)
+            habit_ids = [x for (x,) in source.execute(select([table.c.habit_id]).distinct())]
+
+            for habit_id in habit_ids:
+                owner_key = self.get_bind_key(habit_id)
+                if owner_key == source_key:
+                    continue
+                owner = self.get_engine(owner_key)
+                moves.create(bind=owner, checkfirst=True)
+
+                rows = source.execute(select([table.c.id, table.c.timestamp])
+                                      .where(table.c.habit_id == habit_id)).fetchall()
+                with owner.begin() as connection:
+                    copied = {tuple(x) for x in connection.execute(select([moves.c.source_id, moves.c.timestamp])
+                                                                   .where(moves.c.source_bind == source_name)
+                                                                   .where(moves.c.habit_id == habit_id))}
+                    new_rows = [x for x in rows if (x.id, x.timestamp) not in copied]
+                    if new_rows:
+                        connection.execute(table.insert(), [{'habit_id': habit_id, 'timestamp': x.timestamp}
+                                                            for x in new_rows])
+                        connection.execute(moves.insert(), [{'source_bind': source_name, 'source_id': x.id,
+                                                             'habit_id': habit_id, 'timestamp': x.timestamp}
+                                                            for x in new_rows])
+
+                row_ids = [x.id for x in rows]
+                with source.begin() as connection:
+                    for i in range(0, len(row_ids), SCATTER_CHUNK_SIZE):
+                        connection.execute(table.delete().where(table.c.id.in_(row_ids[i:i + SCATTER_CHUNK_SIZE])))
+                # Only once the source rows are gone, since their IDs may be handed out again afterwards
+                with owner.begin() as connection:
+                    connection.execute(moves.delete().where(moves.c.source_bind == source_name)
+                                       .where(moves.c.habit_id == habit_id))
+                num_moved += len(new_rows)
+
+        return num_moved
+
+    def count_activities(self, habit_ids, start, end):
+        """Counts the activities of every habit in habit_ids between start (included) and end (excluded), across
+        all partitions"""
+        table = self.table
+
+        def make_statement(chunk):
+            return select([table.c.habit_id, func.count()]).where(table.c.habit_id.in_(chunk)).where(
+                table.c.timestamp >= start).where(table.c.timestamp < end).group_by(table.c.habit_id)
+
+        return dict(self.scatter(habit_ids, make_statement))
+
+
+@click.command('rebalance-activity')
+@click.option('--drain', multiple=True, help="Bind to empty that is no longer a partition - 'primary' for the "
+                                             "primary database")
+@with_appcontext
+def rebalance_activity_command(drain):
+    """Move activity rows to the partitions owning their habits."""
+    shards = current_app.extensions['activity_shards']
+    drain_binds = [None if x == 'primary' else x for x in drain]
+    click.echo('Moved {} activity rows'.format(shards.rebalance(drain_binds)))
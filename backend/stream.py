@@ -0,0 +1,116 @@
+import json
+import queue
+import threading
+import time
+
+from flask import current_app
+
+
+class Subscription:
+    """Bounded queue of the messages published to one connected client
+
+    A client that falls more than max_queued messages behind is not allowed to hold memory for the rest - its queue
+    is dropped and it is told to fetch everything again instead.
+    """
+
+    def __init__(self, max_queued):
+        self.queue = queue.Queue(max_queued)
+        self.overflowed = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Returns the next message, None if none arrived within timeout, or False if messages were dropped"""
+        if self.overflowed:
+            self.overflowed = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return False
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LocalBroker:
+    """Fans messages out to the subscriptions of the current worker process
+
+    Messages published by another worker are not seen - a broker shared by all workers of a host only has to offer
+    the same subscribe, unsubscribe and publish methods.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    def subscribe(self, channel, max_queued):
+        subscription = Subscription(max_queued)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, channel, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+
+
+class HabitEventStream:
+    """Pushes changes to the habits of a user as Server-Sent Events to every client the user has connected
+
+    Idle connections only cost a blocked queue read and a comment line every STREAM_HEARTBEAT_SECONDS. Streams are
+    closed after STREAM_MAX_SECONDS and clients reconnect on their own, which keeps any single connection from
+    holding on to a worker indefinitely.
+    """
+
+    def __init__(self, app=None, broker=None):
+        self.broker = broker or LocalBroker()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['habit_event_stream'] = self
+
+    def publish(self, user_id, event_type, data):
+        self.broker.publish(user_id, 'event: {}\ndata: {}\n\n'.format(event_type, json.dumps(data)))
+
+    def stream(self, user_id):
+        """Subscribes to the events of a user and returns the generator writing them out"""
+        config = current_app.config
+        heartbeat_seconds = config.get('STREAM_HEARTBEAT_SECONDS', 15)
+        max_seconds = config.get('STREAM_MAX_SECONDS', 100)
+        subscription = self.broker.subscribe(user_id, config.get('STREAM_MAX_QUEUED', 100))
+
+        def generate():
+            try:
+                # Reconnect right away once the stream is closed after max_seconds
+                yield 'retry: 1000\nevent: ready\ndata: {}\n\n'
+                closes_at = time.monotonic() + max_seconds
+                while True:
+                    remaining = closes_at - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    message = subscription.get(min(heartbeat_seconds, remaining))
+                    if message is None:
+                        yield ': heartbeat\n\n'
+                    elif message is False:
+                        yield 'event: resync\ndata: {}\n\n'
+                    else:
+                        yield message
+            finally:
+                self.broker.unsubscribe(user_id, subscription)
+
+        return generate()
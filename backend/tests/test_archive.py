@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from flask_testing import TestCase
+
+from backend import create_app, db, activity_archive
+from backend.archive import ActivityArchive, ArchiveError, EPOCH
+from backend.config import TestConfig
+from backend.events.utils import get_habit_activity_data
+from backend.models import Activity
+
+CUTOFF_DAY = (datetime(2019, 1, 1).date() - EPOCH).days
+
+
+class ArchiveTestCase(TestCase):
+
+    def create_app(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        class ArchiveConfig(TestConfig):
+            ACTIVITY_ARCHIVE_DIR = self.tmp_dir
+
+        return create_app(ArchiveConfig)
+
+    def setUp(self):
+        db.create_all()
+        for timestamp in (datetime(2018, 6, 1, 10), datetime(2018, 6, 1, 23, 30), datetime(2018, 12, 31, 12),
+                          datetime(2019, 1, 1, 12), datetime(2019, 1, 2, 12)):
+            db.session.add(Activity(habit_id=1, timestamp=timestamp))
+        db.session.commit()
+        self.before = get_habit_activity_data(datetime(2019, 1, 3), 365, 1, 'Asia/Tokyo')
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.tmp_dir)
+
+    # Ensure that compaction moves old activity into the archive without changing what is read
+    def test_compact(self):
+        self.assertEqual(activity_archive.compact(1, 'Asia/Tokyo', CUTOFF_DAY), 3)
+        self.assertEqual(Activity.query.count(), 2)
+        self.assertEqual(activity_archive.get(1).total_count, 3)
+        self.assertEqual(get_habit_activity_data(datetime(2019, 1, 3), 365, 1, 'Asia/Tokyo'), self.before)
+        self.assertEqual(activity_archive.compact(1, 'Asia/Tokyo', CUTOFF_DAY), 0)
+
+    # Ensure that an interrupted compaction is finished by the next run
+    def test_resume(self):
+        with mock.patch.object(ActivityArchive, 'delete_before', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                activity_archive.compact(1, 'Asia/Tokyo', CUTOFF_DAY)
+        self.assertEqual(Activity.query.count(), 5)
+
+        self.assertEqual(activity_archive.compact(1, 'Asia/Tokyo', CUTOFF_DAY + 1), 4)
+        self.assertEqual(activity_archive.get(1).total_count, 4)
+        self.assertEqual(get_habit_activity_data(datetime(2019, 1, 3), 365, 1, 'Asia/Tokyo'), self.before)
+
+    # Ensure that a corrupted archive is detected
+    def test_verify(self):
+        activity_archive.compact(1, 'Asia/Tokyo', CUTOFF_DAY)
+        with open(activity_archive.get_path(1), 'r+b') as f:
+            f.seek(-4, 2)
+            f.write(b'\x07\x00\x00\x00')
+        with self.assertRaises(ArchiveError):
+            activity_archive.get(1).verify()
+
+    # Ensure that archives read once do not keep their files open past the cache size
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), "Needs /proc to count open files")
+    def test_cache_bound(self):
+        activity_archive.cache_size = 2
+        try:
+            num_open = len(os.listdir('/proc/self/fd'))
+            for habit_id in range(2, 12):
+                activity_archive.write(habit_id, 'UTC', CUTOFF_DAY - 10, [1] * 10)
+            for habit_id in range(2, 12):
+                activity_archive.get(habit_id).get_datewise_counts(CUTOFF_DAY - 10, CUTOFF_DAY)
+            self.assertEqual(len(activity_archive._cache), 2)
+            self.assertLessEqual(len(os.listdir('/proc/self/fd')), num_open + 2)
+        finally:
+            activity_archive.cache_size = self.app.config['ACTIVITY_ARCHIVE_CACHE_SIZE']
+
+
+if __name__ == '__main__':
+    unittest.main()
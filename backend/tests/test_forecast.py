@@ -0,0 +1,71 @@
+import json
+import unittest
+
+from flask_testing import TestCase
+
+from backend import create_app, db
+from backend.config import TestConfig
+from backend.events.forecast import forecast_habits
+from backend.models import User, Habit, Category
+
+
+class ForecastTestCase(TestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Category(id=1, name='Check', level=3, ideal_num=0))
+        db.session.add(User(id=1, name='Check', email='check@check.com', password='check'))
+        db.session.add(User(id=2, name='Other', email='other@check.com', password='check'))
+        db.session.add(Habit(id=1, name='Check', curr_num=5, init_num=5, pref_level=2, change_index=0.9,
+                             curr_target=5, user_id=1, cat_id=1))
+        db.session.add(Habit(id=2, name='Other', curr_num=5, init_num=5, pref_level=2, change_index=0.9,
+                             curr_target=5, user_id=2, cat_id=1))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # Ensure that full adherence reaches the ideal on the day the daily rule predicts
+    def test_full_adherence(self):
+        forecast = forecast_habits([5, 0.2], [0.9, 0.9], [0, 0], 30, [1.0], 10, seed=0)
+        # 5 * 0.9 ** 22 is the first value below 0.5
+        self.assertEqual(forecast['expected_day'].tolist(), [[22, 0]])
+        self.assertEqual(forecast['reach_probability'].tolist(), [[1, 1]])
+
+    # Ensure that lower adherence never reaches the ideal sooner
+    def test_adherence_ordering(self):
+        forecast = forecast_habits([5], [0.9], [0], 365, [1.0, 0.75, 0.25], 200, seed=0)
+        self.assertLess(forecast['expected_day'][0, 0], forecast['expected_day'][1, 0])
+        self.assertEqual(forecast['reach_probability'][2, 0], 0)
+        self.assertEqual(forecast['day_bands'][2, 0].tolist(), [float('inf')] * 3)
+
+    # Ensure that the endpoint forecasts only the habits of the logged in user
+    def test_forecast_endpoint(self):
+        auth_token = User.query.get(1).get_auth_token()
+        response = self.client.post('/event/habit/forecast', json={'auth_token': auth_token, 'num_days': 30})
+        data = json.loads(response.data.decode('utf-8'))['data']
+        self.assertEqual([x['habit_id'] for x in data], [1])
+        self.assertEqual(data[0]['scenarios'][0]['expected_day'], 22)
+
+        response = self.client.post('/event/habit/forecast', json={'auth_token': auth_token, 'habit_id': 2})
+        self.assertEqual(json.loads(response.data.decode('utf-8'))['status'], 0)
+
+    # Ensure that the size of a simulation is bounded whatever the request asks for
+    def test_forecast_limits(self):
+        auth_token = User.query.get(1).get_auth_token()
+        response = self.client.post('/event/habit/forecast', json={'auth_token': auth_token,
+                                                                   'adherence': [0.5] * 30})
+        self.assertEqual(json.loads(response.data.decode('utf-8'))['status'], 0)
+
+        self.app.config['FORECAST_MAX_STEPS'] = 5 * 365 * 10
+        response = self.client.post('/event/habit/forecast', json={'auth_token': auth_token, 'num_days': 365,
+                                                                   'adherence': [1.0] * 5, 'num_samples': 1000})
+        self.assertEqual(json.loads(response.data.decode('utf-8'))['data'][0]['num_samples'], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from flask_testing import TestCase
+from sqlalchemy import create_engine, inspect, Index
+
+from backend import create_app, db
+from backend.config import TestConfig
+from backend.migrations import create_missing_indexes
+from backend.models import User, Habit, Activity
+
+# Point this at an empty MySQL-compatible database to run the EXPLAIN checks against it as well
+MYSQL_TEST_URI = os.environ.get('HABBY_MYSQL_TEST_URI')
+
+
+def explain_sqlite(query):
+    statement = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+    rows = db.session.execute('EXPLAIN QUERY PLAN ' + str(statement)).fetchall()
+    return ' '.join(str(row[-1]) for row in rows)
+
+
+class IndexTestCase(TestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def setUp(self):
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # Ensure that activity range lookups are answered from the covering index alone
+    def test_activity_range_plan(self):
+        query = db.session.query(Activity.timestamp).filter(Activity.habit_id == 1,
+                                                            Activity.timestamp <= datetime(2019, 1, 8),
+                                                            Activity.timestamp >= datetime(2019, 1, 1))
+        plan = explain_sqlite(query)
+        self.assertIn('COVERING INDEX ix_activity_habit_id_timestamp', plan)
+
+    # Ensure that listing the habits of a user does not scan the habit table
+    def test_user_habits_plan(self):
+        plan = explain_sqlite(Habit.query.filter_by(user_id=1))
+        self.assertIn('ix_habit_user_id', plan)
+
+    # Ensure that email lookups during login and registration use an index
+    def test_email_plan(self):
+        plan = explain_sqlite(User.query.filter_by(email='check@check.com'))
+        self.assertIn('ix_user_email', plan)
+
+    # Ensure that Snapchat logins use the (name, snapPic) index
+    def test_snap_login_plan(self):
+        plan = explain_sqlite(User.query.filter_by(name='Check', snapPic='https://check.com/check.png'))
+        self.assertIn('ix_user_name_snap_pic', plan)
+
+    # Ensure that indexes missing from an already deployed database get created exactly once
+    def test_create_missing_indexes(self):
+        db.session.execute('DROP INDEX ix_activity_habit_id_timestamp')
+        db.session.commit()
+        self.assertEqual(create_missing_indexes(db.engine, db.metadata), ['ix_activity_habit_id_timestamp'])
+        self.assertEqual(create_missing_indexes(db.engine, db.metadata), [])
+
+    # Ensure that an index another process creates in the meantime is skipped instead of failing the upgrade
+    def test_concurrent_index_creation(self):
+        db.session.execute('DROP INDEX ix_activity_habit_id_timestamp')
+        db.session.commit()
+        create = Index.create
+
+        def create_twice(index, bind):
+            create(index, bind=bind)
+            create(index, bind=bind)
+
+        with mock.patch.object(Index, 'create', autospec=True, side_effect=create_twice) as patched:
+            self.assertEqual(create_missing_indexes(db.engine, db.metadata), [])
+        self.assertEqual(patched.call_count, 1)
+
+    # Ensure that the upgrade-db command creates the indexes missing from a deployed database
+    def test_upgrade_db_command(self):
+        db.session.execute('DROP INDEX ix_activity_habit_id_timestamp')
+        db.session.commit()
+        result = self.app.test_cli_runner().invoke(args=['upgrade-db'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Created ix_activity_habit_id_timestamp', result.output)
+        self.assertIn('ix_activity_habit_id_timestamp',
+                      [x['name'] for x in inspect(db.engine).get_indexes('activity')])
+
+
+@unittest.skipUnless(MYSQL_TEST_URI, "HABBY_MYSQL_TEST_URI is not set")
+class MySQLIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(MYSQL_TEST_URI)
+        db.metadata.create_all(bind=self.engine)
+
+    def tearDown(self):
+        db.metadata.drop_all(bind=self.engine)
+        self.engine.dispose()
+
+    def explain(self, sql):
+        with self.engine.connect() as connection:
+            return connection.execute('EXPLAIN ' + sql).fetchone()
+
+    # Ensure that the activity range lookup is index-only on MySQL as well
+    def test_activity_range_plan(self):
+        row = self.explain("SELECT timestamp FROM activity WHERE habit_id = 1 "
+                           "AND timestamp BETWEEN '2019-01-01' AND '2019-01-08'")
+        self.assertEqual(row['key'], 'ix_activity_habit_id_timestamp')
+        self.assertIn('Using index', row['Extra'] or '')
+
+    # Ensure that the remaining hot lookups pick their indexes on MySQL
+    def test_lookup_plans(self):
+        self.assertEqual(self.explain("SELECT * FROM habit WHERE user_id = 1")['key'], 'ix_habit_user_id')
+        self.assertEqual(self.explain("SELECT * FROM user WHERE email = 'check@check.com'")['key'], 'ix_user_email')
+        self.assertEqual(self.explain("SELECT * FROM user WHERE name = 'Check' AND snapPic = 'check.png'")['key'],
+                         'ix_user_name_snap_pic')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import runpy
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from flask_testing import TestCase
+
+from backend import create_app, db, admission_control
+from backend.config import Config, TestConfig
+from backend.limits import MemoryLimiterStorage, SqliteLimiterStorage
+from backend.models import User, Habit, Category
+
+
+class AdmissionTestCase(TestCase):
+
+    def create_app(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        class LimitsConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(self.tmp_dir, 'site.db')
+            LIMITER_STORAGE_PATH = os.path.join(self.tmp_dir, 'limits.db')
+            CONCURRENCY_LIMITS = {'outbound': 1, 'password': 1}
+            RATE_LIMITS = {'queues.get_sorted_cat': (0.5, 2)}
+
+        return create_app(LimitsConfig)
+
+    def setUp(self):
+        db.session.add(Category(id=1, name='Check', level=3, ideal_num=0))
+        db.session.add(User(id=1, name='Check', email='check@check.com', password='check'))
+        db.session.add(Habit(id=1, name='Check', curr_num=4, init_num=4, pref_level=2, change_index=0.5,
+                             curr_target=4, user_id=1, cat_id=1))
+        db.session.commit()
+        self.auth_token = User.query.get(1).get_auth_token()
+
+    def tearDown(self):
+        db.session.remove()
+        shutil.rmtree(self.tmp_dir)
+
+    def get_sorted_cat(self):
+        return self.client.post('/event/cat/get_sorted', json={'auth_token': self.auth_token, 'text': 'check'})
+
+    # Ensure that a user running out of tokens gets a 429 with Retry-After
+    def test_rate_limit(self):
+        with mock.patch('backend.events.routes.requests.post') as mock_post:
+            mock_post.return_value.json.return_value = {'weightedScoring': 1}
+            self.assert200(self.get_sorted_cat())
+            self.assert200(self.get_sorted_cat())
+            response = self.get_sorted_cat()
+
+        self.assertStatus(response, 429)
+        self.assertEqual(response.headers['Retry-After'], '2')
+
+    # Ensure that anonymous clients are told apart by the address the proxy saw, not by what they put in front of it
+    def test_forwarded_for(self):
+        statuses = []
+        for i in range(3):
+            response = self.client.post('/event/cat/get_sorted', json={'auth_token': 'invalid', 'text': 'check'},
+                                        headers={'X-Forwarded-For': '10.0.0.{}, 192.0.2.1'.format(i)})
+            statuses.append(response.status_code)
+        self.assertEqual(statuses[-1], 429)
+
+        response = self.client.post('/event/cat/get_sorted', json={'auth_token': 'invalid', 'text': 'check'},
+                                    headers={'X-Forwarded-For': '192.0.2.1, 192.0.2.2'})
+        self.assertNotEqual(response.status_code, 429)
+
+    # Ensure that buckets and slots are shared through the storage file, as between two workers
+    def test_shared_storage(self):
+        path = os.path.join(self.tmp_dir, 'shared.db')
+        first, second = SqliteLimiterStorage(path), SqliteLimiterStorage(path)
+        self.assertEqual(first.consume('key', 1, 1), 0)
+        self.assertGreater(second.consume('key', 1, 1), 0)
+        token = first.acquire_slot('class', 1, 60)
+        self.assertIsNone(second.acquire_slot('class', 1, 60))
+        first.release_slot('class', token)
+        self.assertIsNotNone(second.acquire_slot('class', 1, 60))
+
+    # Ensure that buckets which have had time to refill are dropped, from memory and from the storage file alike
+    def test_prune_buckets(self):
+        for storage in (MemoryLimiterStorage(), SqliteLimiterStorage(os.path.join(self.tmp_dir, 'prune.db'))):
+            now = time.time()
+            storage.consume('addr:192.0.2.1', 1, 5)
+            with mock.patch('backend.limits.time.time', return_value=now + 10):
+                storage.consume('addr:192.0.2.2', 1, 5)
+                self.assertEqual(storage.prune_buckets(5), 1)
+                self.assertEqual(storage.prune_buckets(5), 0)
+                # The remaining bucket still holds the token taken from it
+                for _ in range(4):
+                    self.assertEqual(storage.consume('addr:192.0.2.2', 1, 5), 0)
+                self.assertGreater(storage.consume('addr:192.0.2.2', 1, 5), 0)
+
+    # Load test - while the expensive class is saturated by slow outbound calls, further expensive requests are shed
+    # at once and activity reports keep their latency
+    def test_isolation(self):
+        release = threading.Event()
+
+        def slow_post(*args, **kwargs):
+            release.wait(10)
+            return mock.Mock(json=mock.Mock(return_value={'weightedScoring': 1}))
+
+        def timed(call):
+            start = time.perf_counter()
+            response = call()
+            return response.status_code, time.perf_counter() - start
+
+        report = lambda: self.client.post('/event/activity/report',
+                                          json={'auth_token': self.auth_token, 'habit_id': 1})
+
+        with mock.patch('backend.events.routes.requests.post', side_effect=slow_post), \
+                ThreadPoolExecutor(max_workers=8) as executor:
+            blocked = executor.submit(timed, self.get_sorted_cat)
+            time.sleep(0.2)
+            shed = executor.submit(timed, self.get_sorted_cat).result()
+            reports = [x.result() for x in [executor.submit(timed, report) for _ in range(20)]]
+            release.set()
+            self.assertEqual(blocked.result()[0], 200)
+
+        self.assertEqual(shed[0], 503)
+        self.assertLess(shed[1], 0.5)
+        self.assertEqual({x[0] for x in reports}, {200})
+        self.assertLess(max(x[1] for x in reports), 1)
+        # The slot of the blocked request was given back
+        self.assertIsNotNone(admission_control.storage.acquire_slot('outbound', 1, 60))
+
+    # Ensure that the deployed concurrency limits leave worker threads to the cheap endpoints, and that gunicorn
+    # refuses to start when they do not
+    def test_concurrency_headroom(self):
+        conf = runpy.run_path(os.path.join(os.path.dirname(__file__), '..', '..', 'gunicorn.conf.py'))
+        self.assertLess(sum(Config.CONCURRENCY_LIMITS.values()), conf['get_worker_capacity']())
+        conf['on_starting'](None)
+
+        with mock.patch.dict(Config.CONCURRENCY_LIMITS, {'stream': conf['get_worker_capacity']()}):
+            self.assertRaises(RuntimeError, conf['on_starting'], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
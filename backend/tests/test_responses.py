@@ -0,0 +1,56 @@
+import gzip
+import json
+import unittest
+
+from flask_testing import TestCase
+
+from backend import create_app, db
+from backend.config import TestConfig
+from backend.models import User, Habit, Category
+
+
+class ResponsesTestCase(TestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Category(id=1, name='Check', level=3, ideal_num=0))
+        db.session.add(User(id=1, name='Check', email='check@check.com', password='check'))
+        for habit_id in range(1, 21):
+            db.session.add(Habit(id=habit_id, name='Check', curr_num=4, init_num=4, pref_level=2, change_index=0.5,
+                                 curr_target=4, user_id=1, cat_id=1))
+        db.session.commit()
+        self.auth_token = User.query.get(1).get_auth_token()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # Ensure that large responses are compressed only for clients accepting it, and declared as JSON either way
+    def test_compression(self):
+        plain = self.client.post('/event/habit/get_all', json={'auth_token': self.auth_token})
+        self.assertEqual(plain.mimetype, 'application/json')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+        self.assertGreaterEqual(len(plain.data), self.app.config['COMPRESS_MIN_SIZE'])
+
+        compressed = self.client.post('/event/habit/get_all', json={'auth_token': self.auth_token},
+                                      headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(int(compressed.headers['Content-Length']), len(compressed.data))
+        self.assertLess(len(compressed.data), len(plain.data))
+        self.assertEqual(json.loads(gzip.decompress(compressed.data).decode('utf-8')),
+                         json.loads(plain.data.decode('utf-8')))
+
+    # Ensure that small responses are sent as they are
+    def test_small_response(self):
+        response = self.client.post('/event/habit/get_all', json={'auth_token': 'invalid'},
+                                    headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(json.loads(response.data.decode('utf-8')), {'status': 0, 'error': "User Not Authenticated"})
+
+
+if __name__ == '__main__':
+    unittest.main()
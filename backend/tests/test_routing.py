@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask_testing import TestCase
+
+from backend import create_app, db, replica_router
+from backend.config import TestConfig
+from backend.models import User
+from backend.routing import LAST_WRITE_HEADER
+
+
+class RoutingTestCase(TestCase):
+    """Runs against two SQLite files acting as primary and replica - nothing replicates between them, which makes it
+    visible which of the two served a request"""
+
+    def create_app(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        class RoutingConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(self.tmp_dir, 'primary.db')
+            SQLALCHEMY_BINDS = {
+                'replica_0': 'sqlite:///' + os.path.join(self.tmp_dir, 'replica.db'),
+                'replica_1': 'sqlite:///' + os.path.join(self.tmp_dir, 'missing', 'replica.db')
+            }
+            SQLALCHEMY_REPLICA_BINDS = ['replica_0']
+
+        return create_app(RoutingConfig)
+
+    def setUp(self):
+        self.replica = db.get_engine(self.app, bind='replica_0')
+        db.metadata.create_all(bind=self.replica)
+        for engine in (db.engine, self.replica):
+            engine.execute("INSERT INTO user (id, name, email, password, isAdmin, isSnap, timezone) "
+                           "VALUES (1, 'Check', 'check@check.com', 'check', 0, 0, 'UTC')")
+            engine.execute("INSERT INTO category (id, name, level, ideal_num) VALUES (1, 'Check', 3, 0)")
+        self.replica.execute("INSERT INTO habit (id, name, curr_num, init_num, pref_level, change_index, "
+                             "curr_target, user_id, cat_id) VALUES (1, 'Replica', 4, 4, 2, 0.5, 4, 1, 1)")
+        self.auth_token = User.query.get(1).get_auth_token()
+        replica_router._unhealthy_until.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        shutil.rmtree(self.tmp_dir)
+
+    def get_habit_names(self, client=None, headers=None):
+        response = (client or self.client).post('/event/habit/get_all', json={'auth_token': self.auth_token},
+                                                headers=headers)
+        return [x['name'] for x in json.loads(response.data.decode('utf-8'))['data']]
+
+    # Ensure that read-only endpoints are served by the replica
+    def test_reads_use_replica(self):
+        self.assertEqual(self.get_habit_names(), ['Replica'])
+
+    # Ensure that a user reads from the primary right after writing
+    def test_read_after_write(self):
+        self.client.post('/event/habit/attach', json={'auth_token': self.auth_token, 'habit_name': 'Primary',
+                                                      'pref_level': 2, 'cat_id': 1, 'curr_num': 4})
+        self.assertEqual(self.get_habit_names(), ['Primary'])
+
+        self.client.cookie_jar.clear()
+        self.assertEqual(self.get_habit_names(), ['Replica'])
+
+    # Ensure that clients without cookies can send the token of their write back as a header
+    def test_read_after_write_header(self):
+        client = self.app.test_client(use_cookies=False)
+        response = client.post('/event/habit/attach', json={'auth_token': self.auth_token, 'habit_name': 'Primary',
+                                                            'pref_level': 2, 'cat_id': 1, 'curr_num': 4})
+        token = response.headers[LAST_WRITE_HEADER]
+        self.assertEqual(self.get_habit_names(client, {LAST_WRITE_HEADER: token}), ['Primary'])
+        self.assertEqual(self.get_habit_names(client, {LAST_WRITE_HEADER: token[:-1]}), ['Replica'])
+        self.assertEqual(self.get_habit_names(client), ['Replica'])
+
+    # Ensure that a failing replica is skipped and the request falls back to the primary
+    def test_replica_failover(self):
+        replica_router.replica_binds = ['replica_1']
+        try:
+            self.assertEqual(self.get_habit_names(), [])
+            self.assertIn('replica_1', replica_router._unhealthy_until)
+        finally:
+            replica_router.replica_binds = ['replica_0']
+
+
+if __name__ == '__main__':
+    unittest.main()
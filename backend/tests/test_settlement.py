@@ -0,0 +1,141 @@
+import json
+import unittest
+from datetime import date, datetime
+from unittest import mock
+
+from flask_testing import TestCase
+
+from backend import create_app, db
+from backend.config import TestConfig
+from backend.events.utils import get_settlement_timezones, get_habit_activity_data
+from backend.models import User, Habit, Category, Activity
+from backend.projections import SettlementUserRow, SettlementRow, project, iter_chunks, iter_drained
+
+
+class SettlementTestCase(TestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Category(id=1, name='Check', level=3, ideal_num=0))
+        db.session.add(User(id=1, name='Tokyo', email='tokyo@check.com', password='check', timezone='Asia/Tokyo'))
+        db.session.add(User(id=2, name='Denver', email='denver@check.com', password='check',
+                            timezone='America/Denver'))
+        for habit_id, user_id in ((1, 1), (2, 2)):
+            db.session.add(Habit(id=habit_id, name='Check', curr_num=4, init_num=4, pref_level=2, change_index=0.5,
+                                 curr_target=4, user_id=user_id, cat_id=1))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # Ensure that only the timezones whose local day just ended are selected
+    def test_settlement_timezones(self):
+        timezones = get_settlement_timezones(datetime(2019, 1, 1, 15, 0))
+        self.assertIn('Asia/Tokyo', timezones)
+        self.assertNotIn('America/Denver', timezones)
+        self.assertNotIn('UTC', timezones)
+
+    # Ensure that activity is bucketed by the local day of the user
+    def test_local_activity_days(self):
+        db.session.add(Activity(habit_id=1, timestamp=datetime(2019, 1, 1, 16, 0)))
+        db.session.commit()
+        self.assertEqual(get_habit_activity_data(datetime(2019, 1, 3), 7, 1, 'Asia/Tokyo'), {'01-02-19': 1})
+        self.assertEqual(get_habit_activity_data(datetime(2019, 1, 3), 7, 1), {'01-01-19': 1})
+
+    # Ensure that an hourly run only settles its own cohort, counting the local day that just ended
+    def test_hourly_cohort(self):
+        # Tokyo activity on 01-01-19 local time, and one on 01-02-19 local time that must not be counted
+        for hour in (0, 1, 2, 3):
+            db.session.add(Activity(habit_id=1, timestamp=datetime(2018, 12, 31, 15 + hour, 0)))
+        db.session.add(Activity(habit_id=1, timestamp=datetime(2019, 1, 1, 15, 30)))
+        db.session.commit()
+
+        with mock.patch('backend.events.routes.datetime') as mock_datetime:
+            mock_datetime.utcnow.return_value = datetime(2019, 1, 1, 15, 0)
+            response = self.client.get('/event/activity/get_data')
+
+        self.assertEqual(json.loads(response.data.decode('utf-8')), {'status': 1, 'num_settled': 1})
+        self.assertEqual(Habit.query.get(1).curr_num, 2)
+        self.assertEqual(Habit.query.get(2).curr_num, 4)
+
+    # Ensure that a repeated run settles nothing, and that days missed since the last settlement are caught up on
+    def test_settled_days(self):
+        with mock.patch('backend.events.routes.datetime') as mock_datetime:
+            mock_datetime.utcnow.return_value = datetime(2019, 1, 1, 15, 0)
+            self.client.get('/event/activity/get_data')
+            response = self.client.get('/event/activity/get_data')
+        self.assertEqual(json.loads(response.data.decode('utf-8')), {'status': 1, 'num_settled': 0})
+        self.assertEqual(User.query.get(1).last_settled_day, date(2019, 1, 1))
+
+        # Denver last settled 12-29-18 and its midnight hour has long passed, so 12-30 and 12-31 are both settled
+        User.query.get(2).last_settled_day = date(2018, 12, 29)
+        db.session.commit()
+        with mock.patch('backend.events.routes.datetime') as mock_datetime:
+            mock_datetime.utcnow.return_value = datetime(2019, 1, 1, 20, 0)
+            response = self.client.get('/event/activity/get_data')
+        self.assertEqual(json.loads(response.data.decode('utf-8')), {'status': 1, 'num_settled': 2})
+        self.assertEqual(User.query.get(2).last_settled_day, date(2018, 12, 31))
+
+    # Ensure that a day whose midnight is skipped by a DST change is still settled
+    def test_skipped_midnight(self):
+        # Santiago moved from 00:00 straight to 01:00 on 09-08-19, so that day has no hour 0
+        db.session.add(User(id=3, name='Santiago', email='santiago@check.com', password='check',
+                            timezone='America/Santiago', last_settled_day=date(2019, 9, 7)))
+        db.session.commit()
+        self.assertNotIn('America/Santiago', get_settlement_timezones(datetime(2019, 9, 8, 4, 0)))
+
+        with mock.patch('backend.events.routes.datetime') as mock_datetime:
+            mock_datetime.utcnow.return_value = datetime(2019, 9, 9, 4, 30)
+            self.client.get('/event/activity/get_data')
+        self.assertEqual(User.query.get(3).last_settled_day, date(2019, 9, 8))
+
+    # Ensure that existing users can move to their own timezone, and that only real timezones are accepted
+    def test_set_timezone(self):
+        user = User(id=3, name='Check', email='check@check.com', password='check')
+        db.session.add(user)
+        db.session.commit()
+        auth_token = user.get_auth_token()
+
+        response = self.client.post('/timezone/set', json={'auth_token': auth_token, 'timezone': 'Mars/Olympus'})
+        self.assertEqual(json.loads(response.data.decode('utf-8')), {'status': 0, 'error': "Invalid Timezone"})
+        self.assertEqual(User.query.get(3).timezone, 'UTC')
+
+        response = self.client.post('/timezone/set', json={'auth_token': auth_token, 'timezone': 'Asia/Kolkata'})
+        self.assertEqual(json.loads(response.data.decode('utf-8')), {'status': 1})
+        self.assertEqual(User.query.get(3).timezone, 'Asia/Kolkata')
+
+    # Ensure that chunked reads resume after the last key and return every row exactly once
+    def test_iter_chunks(self):
+        for habit_id in range(3, 8):
+            db.session.add(Habit(id=habit_id, name='Check', curr_num=4, init_num=4, pref_level=2, change_index=0.5,
+                                 curr_target=4, user_id=1, cat_id=1))
+        db.session.commit()
+
+        query = project(SettlementRow, Habit.user_id == 1)
+        chunks = list(iter_chunks(SettlementRow, query, Habit.id, chunk_size=2))
+        self.assertEqual([[x.id for x in chunk] for chunk in chunks], [[1, 3], [4, 5], [6, 7]])
+
+        # Every chunk is read in order straight from the user_id index instead of sorting the remaining rows
+        chunk_query = query.filter(Habit.id > 3).order_by(Habit.id).limit(2)
+        statement = chunk_query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+        plan = ' '.join(str(row[-1]) for row in db.session.execute('EXPLAIN QUERY PLAN ' + str(statement)))
+        self.assertIn('ix_habit_user_id', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    # Ensure that drained reads start over until no row matches
+    def test_iter_drained(self):
+        query = project(SettlementUserRow, User.last_settled_day.is_(None))
+        num_chunks = 0
+        for chunk in iter_drained(SettlementUserRow, query, chunk_size=1):
+            num_chunks += 1
+            User.query.get(chunk[0].id).last_settled_day = date(2019, 1, 1)
+            db.session.commit()
+        self.assertEqual(num_chunks, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
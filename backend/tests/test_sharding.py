@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from flask_testing import TestCase
+from sqlalchemy import select, func
+
+from backend import create_app, db, activity_shards
+from backend.config import TestConfig
+from backend.models import User, Habit, Category, Activity, ActivityMove
+
+SHARD_BINDS = ['activity_0', 'activity_1', 'activity_2']
+
+
+class ShardingTestCase(TestCase):
+    """Partitions activity over three SQLite files"""
+
+    def create_app(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        class ShardingConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(self.tmp_dir, 'primary.db')
+            SQLALCHEMY_BINDS = {x: 'sqlite:///' + os.path.join(self.tmp_dir, x + '.db') for x in SHARD_BINDS}
+            ACTIVITY_SHARD_BINDS = SHARD_BINDS
+
+        return create_app(ShardingConfig)
+
+    def setUp(self):
+        db.session.add(Category(id=1, name='Check', level=3, ideal_num=0))
+        db.session.add(User(id=1, name='Check', email='check@check.com', password='check'))
+        for habit_id in range(1, 13):
+            db.session.add(Habit(id=habit_id, name='Check', curr_num=4, init_num=4, pref_level=2, change_index=0.5,
+                                 curr_target=4, user_id=1, cat_id=1))
+        db.session.commit()
+        self.auth_token = User.query.get(1).get_auth_token()
+
+    def tearDown(self):
+        db.session.remove()
+        shutil.rmtree(self.tmp_dir)
+
+    def count_rows(self, bind_key):
+        return activity_shards.get_engine(bind_key).execute(select([func.count()]).select_from(Activity.__table__)) \
+            .scalar()
+
+    # Ensure that habits spread over all partitions and activity only lands on the owning one
+    def test_report_routing(self):
+        self.assertEqual({activity_shards.get_bind_key(x) for x in range(1, 13)}, set(SHARD_BINDS))
+        for habit_id in range(1, 13):
+            self.client.post('/event/activity/report', json={'auth_token': self.auth_token, 'habit_id': habit_id})
+
+        for bind_key in SHARD_BINDS:
+            owned = [x for x in range(1, 13) if activity_shards.get_bind_key(x) == bind_key]
+            self.assertEqual(self.count_rows(bind_key), len(owned))
+        self.assertEqual(self.count_rows(None), 0)
+
+        today = datetime.utcnow().strftime('%m-%d-%y')
+        tomorrow = (datetime.utcnow() + timedelta(days=1)).strftime('%m-%d-%y')
+        response = self.client.post('/event/activity/get_data', json={'auth_token': self.auth_token, 'habit_id': 5,
+                                                                      'mode': 'W', 'test_date': tomorrow})
+        self.assertEqual(json.loads(response.data.decode('utf-8'))['datewise_activity_map'], {today: 1})
+
+    # Ensure that counting scatters to every partition and gathers all counts
+    def test_scatter_gather(self):
+        for habit_id in (1, 2, 3, 4, 5, 6):
+            for _ in range(habit_id):
+                activity_shards.execute(habit_id, Activity.__table__.insert().values(
+                    habit_id=habit_id, timestamp=datetime(2019, 1, 1, 12)))
+        db.session.commit()
+
+        counts = activity_shards.count_activities(range(1, 13), datetime(2019, 1, 1), datetime(2019, 1, 2))
+        self.assertEqual(counts, {1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 6: 6})
+
+    # Ensure that rebalancing moves activity off the primary onto the partitions, and can be run again
+    def test_rebalance(self):
+        for habit_id in range(1, 13):
+            db.session.add(Activity(habit_id=habit_id, timestamp=datetime(2019, 1, 1, 12)))
+        db.session.commit()
+
+        self.assertEqual(activity_shards.rebalance(drain_binds=[None]), 12)
+        self.assertEqual(activity_shards.rebalance(drain_binds=[None]), 0)
+        self.assertEqual(self.count_rows(None), 0)
+        self.assertEqual(sum(self.count_rows(x) for x in SHARD_BINDS), 12)
+
+    # Ensure that an interrupted copy is not duplicated, and that rows written to the owner directly are kept
+    def test_interrupted_rebalance(self):
+        owner_key = activity_shards.get_bind_key(1)
+        owner = activity_shards.get_engine(owner_key)
+        for hour in (10, 12):
+            db.session.add(Activity(habit_id=1, timestamp=datetime(2019, 1, 1, hour)))
+        db.session.commit()
+
+        # Written to the owner by an upgraded instance, earlier than the newest row still on the primary
+        owner.execute(Activity.__table__.insert().values(habit_id=1, timestamp=datetime(2019, 1, 1, 11)))
+        # One row was copied before the rebalance was interrupted
+        owner.execute(Activity.__table__.insert().values(habit_id=1, timestamp=datetime(2019, 1, 1, 10)))
+        owner.execute(ActivityMove.__table__.insert().values(source_bind='primary', source_id=1, habit_id=1,
+                                                             timestamp=datetime(2019, 1, 1, 10)))
+
+        self.assertEqual(activity_shards.rebalance(drain_binds=[None]), 1)
+        self.assertEqual(self.count_rows(None), 0)
+        timestamps = owner.execute(select([Activity.timestamp]).order_by(Activity.timestamp)).fetchall()
+        self.assertEqual([x.hour for (x,) in timestamps], [10, 11, 12])
+        self.assertEqual(owner.execute(select([func.count()]).select_from(ActivityMove.__table__)).scalar(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
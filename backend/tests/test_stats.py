@@ -0,0 +1,113 @@
+import json
+import unittest
+from unittest import mock
+
+from flask_testing import TestCase
+
+from backend import create_app, db
+from backend.config import TestConfig
+from backend.events.stats import get_category_stats, rebuild_category_stats, update_category_stats, \
+    get_habit_metrics, increment
+from backend.models import User, Category, CategoryStat, CategoryStatBucket
+
+
+class CategoryStatsTestCase(TestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Category(id=1, name='Check', level=3, ideal_num=0))
+        db.session.add(User(id=1, name='Check', email='check@check.com', password='check'))
+        db.session.commit()
+        self.auth_token = User.query.get(1).get_auth_token()
+        for curr_num in (4, 8, 30):
+            self.client.post('/event/habit/attach', json={'auth_token': self.auth_token, 'habit_name': 'Check',
+                                                          'pref_level': 2, 'cat_id': 1, 'curr_num': curr_num})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # Ensure that attaching habits keeps the statistics up to date and the endpoint serves them
+    def test_attach(self):
+        response = self.client.post('/event/cat/get_stats', json={'auth_token': self.auth_token, 'cat_id': 1})
+        data = json.loads(response.data.decode('utf-8'))['data']
+        self.assertEqual(data['num_habits'], 3)
+        self.assertAlmostEqual(data['curr_num']['mean'], 14)
+        self.assertAlmostEqual(data['curr_num']['std'], (((4 - 14) ** 2 + (8 - 14) ** 2 + (30 - 14) ** 2) / 3) ** 0.5)
+        self.assertEqual([x['count'] for x in data['curr_num']['histogram']], [0, 0, 0, 1, 1, 0, 1, 0, 0])
+        self.assertEqual(data['level_index']['histogram'][1]['count'], 3)
+
+    # Ensure that changed habits move between buckets, and that reconciling restores what the habits say
+    def test_update_and_reconcile(self):
+        update_category_stats(1, get_habit_metrics(30, 30), get_habit_metrics(15, 30))
+        db.session.commit()
+        stats = get_category_stats(1)
+        self.assertEqual(stats['num_habits'], 3)
+        self.assertEqual(stats['level_index']['histogram'][6]['count'], 1)
+
+        # The habit itself was not changed, so reconciling finds the drift and undoes it
+        self.assertEqual(rebuild_category_stats(), [(1, 'curr_num'), (1, 'level_index')])
+        self.assertEqual(rebuild_category_stats(), [])
+        self.assertEqual(get_category_stats(1)['level_index']['histogram'][1]['count'], 3)
+
+    # Ensure that habits created before the statistics existed are counted in by upgrade-db, and that whatever was
+    # subtracted before it ran is never served as a negative count
+    def test_backfill(self):
+        CategoryStat.query.delete()
+        CategoryStatBucket.query.delete()
+        db.session.commit()
+        update_category_stats(1, get_habit_metrics(30, 30), get_habit_metrics(15, 30))
+        db.session.commit()
+        stats = get_category_stats(1)
+        self.assertEqual(stats['num_habits'], 0)
+        self.assertIsNone(stats['curr_num']['mean'])
+        self.assertEqual(min(x['count'] for x in stats['curr_num']['histogram']), 0)
+
+        CategoryStat.query.delete()
+        CategoryStatBucket.query.delete()
+        db.session.commit()
+        result = self.app.test_cli_runner().invoke(args=['upgrade-db'])
+        self.assertIn('Built the category statistics of the existing habits', result.output)
+        self.assertEqual(get_category_stats(1)['num_habits'], 3)
+        self.assertEqual(rebuild_category_stats(), [])
+
+        # Once built, they are left to the incremental updates
+        result = self.app.test_cli_runner().invoke(args=['upgrade-db'])
+        self.assertNotIn('Built the category statistics', result.output)
+
+    # Ensure that a lost update is detected
+    def test_drift(self):
+        CategoryStat.query.filter_by(cat_id=1, metric='curr_num').update({'total': 41})
+        db.session.commit()
+        self.assertEqual(rebuild_category_stats(), [(1, 'curr_num')])
+        self.assertAlmostEqual(get_category_stats(1)['curr_num']['mean'], 14)
+
+    # Ensure that a row created by a concurrent transaction between the update and the insert is updated instead
+    def test_concurrent_insert(self):
+        execute = db.session.execute
+        calls = []
+
+        def racing_execute(statement, *args, **kwargs):
+            calls.append(statement)
+            if len(calls) == 1:
+                # The update finds nothing, then the other transaction inserts the row and commits
+                execute(CategoryStat.__table__.insert().values(cat_id=2, metric='curr_num', count=1, total=5,
+                                                               total_squares=25))
+                return mock.Mock(rowcount=0)
+            return execute(statement, *args, **kwargs)
+
+        db.session.add(Category(id=2, name='Other', level=3, ideal_num=0))
+        db.session.commit()
+        with mock.patch.object(db.session, 'execute', side_effect=racing_execute):
+            increment(CategoryStat, {'cat_id': 2, 'metric': 'curr_num'}, count=1, total=3, total_squares=9)
+        db.session.commit()
+
+        stat = CategoryStat.query.get((2, 'curr_num'))
+        self.assertEqual((stat.count, stat.total, stat.total_squares), (2, 8, 34))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import json
+import unittest
+
+from flask_testing import TestCase
+
+from backend import create_app, db, admission_control
+from backend.config import TestConfig
+from backend.models import User, Habit, Category
+from backend.stream import LocalBroker
+
+
+class StreamTestCase(TestCase):
+
+    def create_app(self):
+
+        class StreamConfig(TestConfig):
+            STREAM_HEARTBEAT_SECONDS = 0.05
+            STREAM_MAX_SECONDS = 5
+
+        return create_app(StreamConfig)
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Category(id=1, name='Check', level=3, ideal_num=0))
+        db.session.add(User(id=1, name='Check', email='check@check.com', password='check'))
+        db.session.add(Habit(id=1, name='Check', curr_num=4, init_num=4, pref_level=2, change_index=0.5,
+                             curr_target=4, user_id=1, cat_id=1))
+        db.session.commit()
+        self.auth_token = User.query.get(1).get_auth_token()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    # Ensure that a client lagging behind is told to resync instead of queueing without bound
+    def test_backpressure(self):
+        broker = LocalBroker()
+        subscription = broker.subscribe(1, 2)
+        for i in range(5):
+            broker.publish(1, i)
+        broker.publish(2, 'other')
+        self.assertIs(subscription.get(0), False)
+        self.assertIsNone(subscription.get(0))
+        broker.publish(1, 'next')
+        self.assertEqual(subscription.get(0), 'next')
+
+    # Ensure that activity reported from another device is pushed to the open stream, between heartbeats
+    def test_stream(self):
+        response = self.client.get('/event/stream?auth_token=' + self.auth_token, buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        self.assertIn(b'event: ready', next(chunks))
+        self.assertEqual(next(chunks), b': heartbeat\n\n')
+
+        self.client.post('/event/activity/report', json={'auth_token': self.auth_token, 'habit_id': 1})
+        chunk = next(chunks).decode('utf-8')
+        while chunk.startswith(':'):
+            chunk = next(chunks).decode('utf-8')
+        event_type, data = chunk.strip().split('\n')
+        self.assertEqual(event_type, 'event: activity')
+        self.assertEqual(json.loads(data[len('data: '):])['habit_id'], 1)
+
+        # Closing the stream gives back its connection slot
+        response.close()
+        self.assertIsNotNone(admission_control.storage.acquire_slot('stream', 2, 60))
+        self.assertIsNotNone(admission_control.storage.acquire_slot('stream', 2, 60))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,8 @@
 from flask import Blueprint, request
 from backend.models import User
+from backend.responses import json_response
 from backend import db, bcrypt
-import json
-from backend.users.utils import send_reset_email
+from backend.users.utils import send_reset_email, get_valid_timezone
 
 users = Blueprint('users', __name__)
 
@@ -24,9 +24,9 @@ def login():
                 'isAdmin': user.isAdmin,
                 'status': 1
             }
-            return json.dumps(final_dict)
+            return json_response(final_dict)
         else:
-            return json.dumps({'status': 0, 'error': "You need to register before you can log in."})
+            return json_response({'status': 0, 'error': "You need to register before you can log in."})
     email = request_json['email']
     password = request_json['password']
     user = User.query.filter_by(email=email).first()
@@ -39,13 +39,13 @@ def login():
             'isAdmin': user.isAdmin,
             'status': 1
         }
-        return json.dumps(final_dict)
+        return json_response(final_dict)
     else:
         final_dict = {
             'status': 0,
             'error': "The provided combination of email and password is incorrect."
         }
-        return json.dumps(final_dict)
+        return json_response(final_dict)
 
 
 # End-point to enable a user to register on the website
@@ -54,21 +54,40 @@ def normal_register():
     request_json = request.get_json()
     if request_json['isSnap']:
         user = User(email="snapchat@snapchat.com", password="password", name=request_json['name'], isSnap=True,
-                    snapPic=request_json['snapPic'], isAdmin=False)
+                    snapPic=request_json['snapPic'], isAdmin=False,
+                    timezone=get_valid_timezone(request_json.get('timezone')))
         db.session.add(user)
         db.session.commit()
-        return json.dumps({'id': user.id, 'status': 1})
-    if User.query.filter_by(email=request_json['email']).first():
-        return json.dumps({'status': 0, 'output': User.query.filter_by(email=request_json['email']).first().email,
-                          'error': "User Already Exists"})
+        return json_response({'id': user.id, 'status': 1})
+    existing_user = User.query.filter_by(email=request_json['email']).first()
+    if existing_user:
+        return json_response({'status': 0, 'output': existing_user.email, 'error': "User Already Exists"})
     email = request_json['email']
     hashed_pwd = bcrypt.generate_password_hash(request_json['password']).decode('utf-8')
     name = request_json['name']
     # noinspection PyArgumentList
-    user = User(email=email, password=hashed_pwd, name=name, isAdmin=False)
+    user = User(email=email, password=hashed_pwd, name=name, isAdmin=False,
+                timezone=get_valid_timezone(request_json.get('timezone')))
     db.session.add(user)
     db.session.commit()
-    return json.dumps({'id': user.id, 'status': 1})
+    return json_response({'id': user.id, 'status': 1})
+
+
+# End-point to enable a user to change the timezone their days are settled in
+@users.route('/timezone/set', methods=['POST'])
+def set_timezone():
+    request_json = request.get_json()
+    user = User.verify_auth_token(request_json['auth_token'])
+    if user is None:
+        return json_response({'status': 0, 'error': "User Not Authenticated"})
+    timezone = request_json.get('timezone')
+    if get_valid_timezone(timezone) != timezone:
+        return json_response({'status': 0, 'error': "Invalid Timezone"})
+    # last_settled_day carries over - settlement resumes with the next local day in the new timezone that is after
+    # it, so moving either way never settles a day twice
+    user.timezone = timezone
+    db.session.commit()
+    return json_response({'status': 1})
 
 
 # End-point to enable a user to change their access level to administrator
@@ -78,7 +97,7 @@ def master_add():
     user = User.query.filter_by(email=request_json['email']).first()
     user.isAdmin = True
     db.session.commit()
-    return json.dumps({'status': 1})
+    return json_response({'status': 1})
 
 
 # End-point to enable a user to request a new password
@@ -88,9 +107,9 @@ def request_reset_password():
     user = User.query.filter_by(email=request_json['email']).first()
     if user:
         send_reset_email(user)
-        return json.dumps({'status': 1})
+        return json_response({'status': 1})
     else:
-        return json.dumps({'status': 0, 'error': "User Not Found"})
+        return json_response({'status': 0, 'error': "User Not Found"})
 
 
 # End-point to enable a user to verify their password reset request
@@ -99,9 +118,9 @@ def verify_reset_token():
     request_json = request.get_json()
     user = User.verify_reset_token(request_json['token'])
     if user is None:
-        return json.dumps({'status': 0, 'error': "Sorry, the link is invalid or has expired. Please submit password reset request again."})
+        return json_response({'status': 0, 'error': "Sorry, the link is invalid or has expired. Please submit password reset request again."})
     else:
-        return json.dumps({'status': 1})
+        return json_response({'status': 1})
 
 
 # End-point to enable a user to set up a new password
@@ -110,13 +129,13 @@ def reset_password():
     request_json = request.get_json()
     user = User.verify_reset_token(request_json['token'])
     if user is None:
-        return json.dumps({'status': 0,
-                           'error': "Sorry, the link is invalid or has expired. Please submit password reset request again."})
+        return json_response({'status': 0,
+                              'error': "Sorry, the link is invalid or has expired. Please submit password reset request again."})
     else:
         hashed_pwd = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
         user.password = hashed_pwd
         db.session.commit()
-        return json.dumps({'status': 1})
+        return json_response({'status': 1})
 
 
 # Checker to see if the server is up and running
@@ -1,6 +1,7 @@
 from backend import mail
 from flask import url_for
 from flask_mail import Message
+from pytz import all_timezones_set
 
 
 def send_reset_email(user):
@@ -10,3 +11,9 @@ def send_reset_email(user):
 
 Kindly ignore this email if you did not make this request'''
     mail.send(msg)
+
+
+def get_valid_timezone(tz_name):
+    if tz_name in all_timezones_set:
+        return tz_name
+    return 'UTC'
@@ -0,0 +1,25 @@
+import os
+
+timeout = 120
+
+# gthread serves every request from a thread of its own, which open event streams tie up for minutes. gevent serves
+# them all from greenlets instead, so thousands of idle streams fit in one worker - raise STREAM_CONNECTION_LIMIT
+# along with it.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = 12
+worker_connections = 2000
+
+
+def get_worker_capacity():
+    """Returns the number of requests a worker serves at once"""
+    return worker_connections if worker_class == 'gevent' else threads
+
+
+def on_starting(server):
+    # The expensive endpoints together must not be able to take every request a worker serves at once, or the cheap
+    # ones have nothing left to run on
+    from backend.config import Config
+    reserved = sum(Config.CONCURRENCY_LIMITS.values())
+    if reserved >= get_worker_capacity():
+        raise RuntimeError('CONCURRENCY_LIMITS add up to {}, which leaves none of the {} requests a {} worker serves '
+                           'at once to the other endpoints'.format(reserved, get_worker_capacity(), worker_class))